@@ -0,0 +1,340 @@
+# -----------------------------------------------------------------------------
+# batch.py
+#
+# Runs a program parsed by compiler.py for a batch of inputs at once, with
+# NumPy.  The inputs give the values of some of the variables declared at the
+# top level of the program for each run, or lane, of the batch, replacing the
+# values they are declared with:
+#
+#     batch.run(statements, {'a': [1, 2, 3]})
+#
+# runs the program three times, with int a = 1, 2 and 3.
+#
+# Every variable is an array with a value for each lane.  Operations are done
+# on whole arrays, and statements run under a mask of the lanes that reach
+# them: the branches of an if run for the lanes whose condition holds, and a
+# while loop runs until its condition is false in every lane.
+#
+# Lanes hold NumPy ints, floats and booleans when all their values have the
+# same one of these types, and Python objects otherwise.  Where NumPy would
+# give a different result than Python (an int overflowing 64 bits, division
+# by zero, a power that Python would make a float or complex number of) or an
+# operation fails, the lane is dropped from the batch and run on its own with
+# closures.py once the batch is done.
+#
+# NumPy is only imported when a batch is run.
+# -----------------------------------------------------------------------------
+
+import operator
+import tac
+import closures
+
+np = None
+
+# Ints beyond this are not exactly floats
+max_exact_float = 2 ** 53
+
+# Int results estimated with floats beyond this may overflow 64 bits
+max_int = 2.0 ** 62
+
+arithmetic_ops = {'+', '-', '*', '/', '^'}
+
+# Import NumPy
+def _numpy():
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+# Return a literal for a value in the statements of a program
+def literal(value):
+    if isinstance(value, str):
+        return ('string', value)
+    return value
+
+# -----------------------------------------------------------------------------
+# Batch
+#
+# The results of a batch.  variables[i] holds the final values of the
+# variables of lane i, printed[i] the values it printed and errors[i] the
+# error that stopped it, if any.
+# -----------------------------------------------------------------------------
+class Batch(object):
+    def __init__(self, size):
+        self.size = size
+        self.variables = [{} for _ in range(size)]
+        self.printed = [[] for _ in range(size)]
+        self.errors = {}
+
+# -----------------------------------------------------------------------------
+# Lanes
+#
+# Variables with a value in each of size lanes, and the operations on them.
+# Lanes where an operation fails or would give a different result than in
+# Python are dropped from alive.
+# -----------------------------------------------------------------------------
+class Lanes(object):
+    def __init__(self, size):
+        _numpy()
+        self.size = size
+        self.env = {}
+        self.alive = np.ones(size, bool)
+        self.constants = {}
+        self.none = np.full(size, None, object)
+
+    # Drop lanes
+    def fail(self, lanes):
+        self.alive[lanes] = False
+
+    # Return an array of Python values, of a NumPy type if they all have one
+    def array(self, values):
+        types = set(map(type, values))
+        if types == {bool}:
+            return np.array(values, bool)
+        if types == {float}:
+            return np.array(values, np.float64)
+        if types == {int} and -max_int <= min(values) and max(values) <= max_int:
+            return np.array(values, np.int64)
+        result = np.empty(len(values), object)
+        result[:] = values
+        return result
+
+    def normalize(self, values):
+        if values.dtype == object:
+            return self.array(values.tolist())
+        return values
+
+    def constant(self, value):
+        key = (type(value), value)
+        if key not in self.constants:
+            self.constants[key] = self.array([value] * self.size)
+        return self.constants[key]
+
+    # Return the values of new in the lanes of mask and of old elsewhere
+    def merge(self, old, new, mask):
+        if mask.all():
+            return new
+        if old.dtype == new.dtype:
+            return np.where(mask, new, old)
+        return self.normalize(np.where(mask, new.astype(object), old.astype(object)))
+
+    def assign(self, name, values, mask):
+        self.env[name] = self.merge(self.env.get(name, self.none), values, mask)
+
+    # Return the lanes in mask whose values are true
+    def truth(self, values, mask):
+        if values.dtype == bool:
+            return values & mask
+        if values.dtype != object:
+            return (values != 0) & mask
+        result = np.zeros(self.size, bool)
+        for i in np.flatnonzero(mask).tolist():
+            result[i] = bool(values[i])
+        return result
+
+    # Return the values of an expression.  Lanes outside mask get values
+    # that don't mean anything.
+    def value(self, node, mask):
+        if isinstance(node, tuple):
+            kind = node[0]
+            if kind == 'string':
+                return self.constant(node[1])
+            if kind == 'neg':
+                return self.negate(self.value(node[1], mask), mask)
+            if kind == 'operation':
+                _, left, op, right = node
+                a = self.value(left, mask)
+                if op in ('and', 'or'):
+                    # The right operand is only evaluated in the lanes where
+                    # it's the result
+                    right_lanes = self.truth(a, mask)
+                    if op == 'or':
+                        right_lanes = mask & ~right_lanes
+                    if not right_lanes.any():
+                        return a
+                    return self.merge(a, self.value(right, right_lanes), right_lanes)
+                return self.operate(op, a, self.value(right, mask), mask)
+            raise ValueError('Unknown expression %r' % (node,))
+        if isinstance(node, str):
+            return self.env.get(node, self.none)
+        return self.constant(node)
+
+    # Apply a Python function to the values of the lanes in mask, one lane at a
+    # time
+    def each(self, f, mask, *arrays):
+        arrays = [values.astype(object) for values in arrays]
+        result = np.full(self.size, None, object)
+        failed = []
+        for i in np.flatnonzero(mask).tolist():
+            try:
+                result[i] = f(*[values[i] for values in arrays])
+            except (ArithmeticError, TypeError, ValueError):
+                failed.append(i)
+        self.fail(failed)
+        return self.normalize(result)
+
+    def negate(self, a, mask):
+        if a.dtype == object:
+            return self.each(operator.neg, mask, a)
+        if a.dtype == bool:
+            a = a.astype(np.int64)
+        elif a.dtype == np.int64:
+            self.fail(mask & (a == np.iinfo(np.int64).min))
+        return -a
+
+    def operate(self, op, a, b, mask):
+        f = tac.operations[op]
+        if a.dtype == object or b.dtype == object:
+            return self.each(f, mask, a, b)
+
+        ints = a.dtype != np.float64 and b.dtype != np.float64
+        floats = a.dtype == np.float64 and b.dtype == np.float64
+        # Ints are made floats in operations with floats and division.  Python
+        # does this exactly and NumPy by rounding.
+        if not ints and not floats or op == '/' and not floats:
+            failed = np.zeros(self.size, bool)
+            for values in (a, b):
+                if values.dtype == np.int64:
+                    failed |= np.abs(values) > max_exact_float
+        else:
+            failed = None
+
+        if op not in arithmetic_ops:
+            result = f(a, b)
+        else:
+            if a.dtype == bool:
+                a = a.astype(np.int64)
+            if b.dtype == bool:
+                b = b.astype(np.int64)
+            if op == '/':
+                zero = b == 0
+                failed = zero if failed is None else failed | zero
+                result = a / np.where(zero, 1, b)
+            elif op == '^' and ints:
+                negative = b < 0
+                b = np.where(negative, 0, b)
+                estimate = a.astype(np.float64) ** b
+                failed = negative | ~(np.abs(estimate) <= max_int)
+                result = a ** b
+            elif op == '^':
+                result = a ** b
+                overflow = ~np.isfinite(result) & np.isfinite(a) & np.isfinite(b)
+                failed = overflow if failed is None else failed | overflow
+            elif ints:
+                failed = ~(np.abs(f(a.astype(np.float64), b.astype(np.float64))) <= max_int)
+                result = f(a, b)
+            else:
+                result = f(a, b)
+        if failed is not None:
+            self.fail(failed & mask)
+        return result
+
+# -----------------------------------------------------------------------------
+# BatchRunner
+# -----------------------------------------------------------------------------
+class BatchRunner(Lanes):
+    def __init__(self, statements, inputs):
+        inputs = {name: list(values) for name, values in inputs.items()}
+        sizes = {len(values) for values in inputs.values()}
+        if len(sizes) != 1:
+            raise ValueError('Inputs must have the same number of values')
+        Lanes.__init__(self, sizes.pop())
+        self.statements = statements
+        self.inputs = inputs
+        declared = {node[2] for node in statements or () if node[0] in ('declare', 'declare assign')}
+        for name in self.inputs:
+            if name not in declared:
+                raise ValueError('%s is not declared at the top level' % name)
+        self.prints = []
+
+    def run(self):
+        with np.errstate(all='ignore'):
+            self.block(self.statements, np.ones(self.size, bool), top=True)
+
+        result = Batch(self.size)
+        for lanes, values in self.prints:
+            for i, value in zip(lanes, values):
+                result.printed[i].append(value)
+        for name, values in self.env.items():
+            for i, value in enumerate(values.tolist()):
+                result.variables[i][name] = value
+        for i in np.flatnonzero(~self.alive).tolist():
+            self.scalar(i, result)
+        return result
+
+    # Run lane i with closures.py
+    def scalar(self, i, result):
+        statements = []
+        for node in self.statements:
+            if node[0] in ('declare', 'declare assign') and node[2] in self.inputs:
+                node = ('declare assign', node[1], node[2], literal(self.inputs[node[2]][i]))
+            statements.append(node)
+        printed = result.printed[i] = []
+        try:
+            result.variables[i] = closures.compile_statements(statements, printed.append).run()
+        except (ArithmeticError, TypeError, ValueError) as e:
+            result.variables[i] = {}
+            result.errors[i] = e
+
+    def block(self, nodes, mask, top=False):
+        for node in nodes or ():
+            mask = mask & self.alive
+            if not mask.any():
+                return
+            self.statement(node, mask, top)
+
+    def statement(self, node, mask, top=False):
+        kind = node[0]
+        if kind in ('declare', 'declare assign'):
+            if top and node[2] in self.inputs:
+                values = self.array(self.inputs[node[2]])
+            elif kind == 'declare':
+                values = self.constant(tac.defaults[node[1]])
+            else:
+                values = self.value(node[3], mask)
+            self.assign(node[2], values, mask)
+        elif kind == 'assign':
+            self.assign(node[1], self.value(node[2], mask), mask)
+        elif kind == 'print':
+            values = self.value(node[1], mask)
+            lanes = np.flatnonzero(mask & self.alive)
+            self.prints.append((lanes.tolist(), values[lanes].tolist()))
+        elif kind == 'condition':
+            self.condition(node, mask)
+        elif kind == 'for':
+            self.statement(node[1], mask)
+            self.loop(node[2], tuple(node[4] or ()) + (node[3],), mask)
+        elif kind == 'while':
+            self.loop(node[1], node[2], mask)
+        else:
+            raise ValueError('Unknown statement %r' % (node,))
+
+    # if / elif / else.  Each branch runs for the lanes whose condition holds
+    # and whose earlier conditions didn't.
+    def condition(self, node, mask):
+        _, ifpart, elifs, elsepart = node
+        for _, cond, body in (ifpart,) + tuple(elifs or ()):
+            taken = self.truth(self.value(cond, mask), mask) & self.alive
+            if taken.any():
+                self.block(body, taken)
+            mask = mask & ~taken & self.alive
+            if not mask.any():
+                return
+        if elsepart:
+            self.block(elsepart[1], mask)
+
+    # Lanes leave a loop when their condition is false, and the loop ends when
+    # no lanes are left
+    def loop(self, cond, body, mask):
+        while True:
+            mask = self.truth(self.value(cond, mask), mask) & self.alive
+            if not mask.any():
+                return
+            self.block(body, mask)
+            mask = mask & self.alive
+
+# Run statements for a batch of inputs, a dict from the names of variables
+# declared at the top level to their values in each lane
+def run(statements, inputs):
+    return BatchRunner(statements, inputs).run()
@@ -0,0 +1,258 @@
+# -----------------------------------------------------------------------------
+# closures.py
+#
+# Runs the programs parsed by compiler.py by turning every node of their
+# statements into a Python closure, once, before running them.  Which
+# operator, variable or kind of statement a closure deals with is settled
+# when it's made, so running a program is just a chain of direct calls.
+#
+# The variables of a program are numbered, and their values are kept in a
+# list, env, that is passed to every closure.  Expression closures return
+# the value of the expression and statement closures return nothing.
+# Variables read before they are given a value are None.
+# -----------------------------------------------------------------------------
+
+import tac
+import ssa
+import vectorize
+
+# Kinds of operands, for the closures specialized on them
+CONST = 0
+VAR = 1
+CALL = 2
+
+def _nothing(env):
+    pass
+
+# -----------------------------------------------------------------------------
+# Program
+#
+# A compiled program.  run() runs it and returns the final values of its
+# variables.
+# -----------------------------------------------------------------------------
+class Program(object):
+    def __init__(self, body, slots):
+        self.body = body
+        self.slots = slots
+
+    def run(self):
+        env = [None] * len(self.slots)
+        self.body(env)
+        return {name: env[i] for name, i in self.slots.items()}
+
+# -----------------------------------------------------------------------------
+# ClosureCompiler
+# -----------------------------------------------------------------------------
+class ClosureCompiler(object):
+    def __init__(self, show=tac.show):
+        self.show = show
+        self.slots = {}
+
+    def compile(self, statements):
+        return Program(self.block(statements), self.slots)
+
+    # Return the number of the slot of a variable in env
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    # Return one closure running a list of statements
+    def block(self, nodes):
+        code = tuple(self.statement(node) for node in nodes or ())
+        if not code:
+            return _nothing
+        if len(code) == 1:
+            return code[0]
+        if len(code) == 2:
+            first, second = code
+            def run(env):
+                first(env)
+                second(env)
+            return run
+        def run(env):
+            for statement in code:
+                statement(env)
+        return run
+
+    def statement(self, node):
+        kind = node[0]
+        if kind == 'declare':
+            return self.assign(node[2], (CONST, tac.defaults[node[1]]))
+        if kind == 'declare assign':
+            return self.assign(node[2], self.operand(node[3]))
+        if kind == 'assign':
+            return self.assign(node[1], self.operand(node[2]))
+        if kind == 'print':
+            return self.print_value(node[1])
+        if kind == 'condition':
+            return self.condition(node)
+        if kind == 'for':
+            return self.counted(node) or self.loop(node[2], tuple(node[4] or ()) + (node[3],), init=node[1])
+        if kind == 'while':
+            return self.loop(node[1], node[2])
+        raise ValueError('Unknown statement %r' % (node,))
+
+    def assign(self, name, operand):
+        i = self.slot(name)
+        kind, x = operand
+        if kind == CONST:
+            def run(env):
+                env[i] = x
+        elif kind == VAR:
+            def run(env):
+                env[i] = env[x]
+        else:
+            def run(env):
+                env[i] = x(env)
+        return run
+
+    def print_value(self, node):
+        show = self.show
+        value = self.expression(node)
+        def run(env):
+            show(value(env))
+        return run
+
+    # if / elif / else
+    def condition(self, node):
+        _, ifpart, elifs, elsepart = node
+        branches = tuple((self.expression(cond), self.block(body))
+                         for _, cond, body in (ifpart,) + tuple(elifs or ()))
+        otherwise = self.block(elsepart[1]) if elsepart else _nothing
+        if len(branches) == 1:
+            (cond, body), = branches
+            def run(env):
+                if cond(env):
+                    body(env)
+                else:
+                    otherwise(env)
+            return run
+        def run(env):
+            for cond, body in branches:
+                if cond(env):
+                    body(env)
+                    return
+            otherwise(env)
+        return run
+
+    # for and while loops.  The step of a for loop is the last statement of
+    # its body.
+    def loop(self, cond, body, init=None):
+        cond = self.expression(cond)
+        body = self.block(body)
+        if init:
+            init = self.statement(init)
+            def run(env):
+                init(env)
+                while cond(env):
+                    body(env)
+        else:
+            def run(env):
+                while cond(env):
+                    body(env)
+        return run
+
+    # Counted for loops that vectorize.py may be able to run with NumPy try
+    # that after their initialization, and run as loops if it can't.  Returns
+    # None for other loops.
+    def counted(self, node):
+        loop = vectorize.counted_loop(node)
+        if loop is None:
+            return None
+        init = self.statement(node[1])
+        scalar = self.loop(node[2], tuple(node[4] or ()) + (node[3],))
+        slots = [(name, self.slot(name)) for name in sorted(loop.names)]
+        def run(env):
+            init(env)
+            values = loop.run({name: env[i] for name, i in slots})
+            if values is None:
+                scalar(env)
+            else:
+                for name, i in slots:
+                    if name in values:
+                        env[i] = values[name]
+        return run
+
+    # Return the kind and value of an operand: (CONST, value), (VAR, slot) or
+    # (CALL, closure)
+    def operand(self, node):
+        if isinstance(node, tuple):
+            kind = node[0]
+            if kind == 'string':
+                return (CONST, node[1])
+            if kind == 'neg':
+                return self.negation(node[1])
+            if kind == 'operation':
+                return self.operation(*node[1:])
+            raise ValueError('Unknown expression %r' % (node,))
+        if isinstance(node, str):
+            return (VAR, self.slot(node))
+        return (CONST, node)
+
+    # Return a closure computing the value of an expression
+    def expression(self, node):
+        kind, x = self.operand(node)
+        if kind == CONST:
+            return lambda env: x
+        if kind == VAR:
+            return lambda env: env[x]
+        return x
+
+    def negation(self, node):
+        kind, x = self.operand(node)
+        if kind == CONST:
+            return self.constant('neg', x)
+        if kind == VAR:
+            return (CALL, lambda env: -env[x])
+        return (CALL, lambda env: -x(env))
+
+    # Operations on constants are done now with ssa.fold(), unless they fail or
+    # would build a huge number or string
+    def constant(self, op, a, b=None):
+        value = ssa.fold(op, tac.Const(a), None if b is None else tac.Const(b))
+        if value is ssa.varying:
+            return (CALL, lambda env: tac.evaluate(op, a, b))
+        return (CONST, value.value)
+
+    def operation(self, left, op, right):
+        if op in ('and', 'or'):
+            a = self.expression(left)
+            b = self.expression(right)
+            if op == 'and':
+                return (CALL, lambda env: a(env) and b(env))
+            return (CALL, lambda env: a(env) or b(env))
+        lkind, a = self.operand(left)
+        rkind, b = self.operand(right)
+        if lkind == rkind == CONST:
+            return self.constant(op, a, b)
+
+        f = tac.operations[op]
+        if lkind == VAR:
+            if rkind == CONST:
+                return (CALL, lambda env: f(env[a], b))
+            if rkind == VAR:
+                return (CALL, lambda env: f(env[a], env[b]))
+            return (CALL, lambda env: f(env[a], b(env)))
+        if lkind == CONST:
+            if rkind == VAR:
+                return (CALL, lambda env: f(a, env[b]))
+            return (CALL, lambda env: f(a, b(env)))
+        if rkind == CONST:
+            return (CALL, lambda env: f(a(env), b))
+        if rkind == VAR:
+            return (CALL, lambda env: f(a(env), env[b]))
+        return (CALL, lambda env: f(a(env), b(env)))
+
+# Compile the statements of a program
+def compile_statements(statements, show=tac.show):
+    return ClosureCompiler(show).compile(statements)
+
+if __name__ == '__main__':
+    # Chains of operations on constants whose results would be too big are
+    # left to run time instead of hanging the compiler
+    for node in [('operation', ('operation', ('operation', 3, '^', 1000), '^', 1000), '^', 1000),
+                 ('operation', ('operation', ('operation', ('string', 'aaaa'), '*', 4096), '*', 4096), '*', 4096)]:
+        assert ClosureCompiler(tac.show).operand(node)[0] == CALL, node
+        assert ClosureCompiler(tac.show).operand(node[1][1])[0] == CONST, node
+    print('ok')
@@ -1,5 +1,14 @@
+import os
+import re
+import sys
 import ply.yacc as yacc
 import ply.lex as lex
+import tac
+import ir
+import ssa
+import pycode
+import closures
+import vm
 
 commands = []
 
@@ -60,10 +69,10 @@ t_RKEY = r'}'
 t_FINISH = r';'
 
 # Tokens
-def t_NAME(t):
-    r'[a-zA-Z_][a-zA-Z_0-9]*'
-    t.type = reserved.get(t.value,'NAME')    # Check for reserved words
-    return t
+t_NAME = r'[a-zA-Z_][a-zA-Z_0-9]*'
+
+# Reserved words are looked up in the NAME matches by the lexer itself
+keywords = {'NAME': reserved}
 
 def t_FNUMBER(t):
     r'\d+\.\d+'
@@ -76,23 +85,52 @@ def t_INUMBER(t):
     t.value = int(t.value)
     return t
 
+# Escape sequences in string literals.  Any other escaped character is kept
+# with its backslash.
+string_escapes = {'"': '"', '\\': '\\', 'n': '\n', 't': '\t'}
+string_body = re.compile(r'[^"\\\n]*(?:\\.[^"\\\n]*)*')
+string_escape = re.compile(r'\\(.)')
+
+# String literals are scanned by hand from the opening quote.  Most strings
+# have no escapes, so the closing quote is found with str.find and the value is
+# a plain slice.  Otherwise the body is matched up to the real closing quote and
+# unescaped in one pass.
 def t_STRING(t):
-    r'\"([^\\\n]|(\\.))*?\"'
-    t.value = t.value.replace("\"","")
+    r'\"'
+    data = t.lexer.lexdata
+    start = t.lexpos + 1
+    end = data.find('"', start)
+    if end >= 0 and data.find('\\', start, end) < 0 and data.find('\n', start, end) < 0:
+        t.value = data[start:end]
+    else:
+        end = string_body.match(data, start).end()
+        if data[end:end + 1] != '"':
+            # Unterminated string.  Only the opening quote is skipped
+            print("Illegal character '%s'" % t.value)
+            return None
+        t.value = string_escape.sub(lambda m: string_escapes.get(m.group(1), m.group()), data[start:end])
+    t.lexer.lexpos = end + 1
     return t
 
-t_ignore = " \t"
-
-def t_newline(t):
-    r'\n+'
-    t.lexer.lineno += t.value.count("\n")
+# Newlines are skipped with the other layout and counted by the lexer
+t_ignore = " \t\n"
 
+# The lexer is built with bulkerrors, so t.value is a whole run of illegal
+# characters, reported and skipped at once
 def t_error(t):
-    print("Illegal character '%s'" % t.value[0])
-    t.lexer.skip(1)
+    print("Illegal character '%s'" % t.value)
+    t.lexer.skip(len(t.value))
+
+# Rule match counts measured over data.txt with lex.lex(instrument=True).
+# The lexer tries the most frequent rules first where the order doesn't matter.
+lexprofile = {
+    't_NAME': 37, 't_FINISH': 14, 't_LPAREN': 10, 't_RPAREN': 10, 't_ASSIGN': 7,
+    't_STRING': 6, 't_INUMBER': 5, 't_LKEY': 5, 't_RKEY': 5, 't_EQUALS': 3,
+    't_PLUS': 2, 't_LESS': 1, 't_L_EQUALS': 1,
+}
 
 # Build the lexer
-lexer = lex.lex()
+lexer = lex.lex(newlines=True, bulkerrors=True, lazylines=True)
 
 # Parsing rules
 
@@ -105,12 +143,17 @@ precedence = (
     ('right', 'UMINUS'),
 )
 
-def p_start(p):
+@yacc.VALUES
+def p_start(statement):
     '''start : statement'''
     global commands
-    commands = p[1]
+    commands = statement
+    return statement
 
-def p_statement(p):
+# rest is the FINISH and the statements after it, just the statements after
+# it, or nothing for empty
+@yacc.VALUES
+def p_statement(statement, *rest):
     '''statement : statement_print FINISH statement
                 | statement_declare FINISH statement
                 | statement_declare_assign FINISH statement
@@ -119,15 +162,13 @@ def p_statement(p):
                 | statement_for statement
                 | statement_while statement
                 | empty'''
-    if len(p) > 2:
-        if p[2] == ';':
-            p[2] = p[3]
-        p[0] = (p[1],) + p[2]
-    else:
-        p[0]=()
+    if not rest:
+        return ()
+    return (statement,) + rest[-1]
         
 # Operations
-def p_expression_binop(p):
+@yacc.VALUES
+def p_expression_binop(left, op, right):
     '''expression : expression PLUS expression
                   | expression MINUS expression
                   | expression TIMES expression
@@ -141,23 +182,28 @@ def p_expression_binop(p):
                   | expression LESS expression
                   | expression AND expression
                   | expression OR expression'''
-    p[0] = ('operation',p[1],p[2],p[3])
+    return ('operation', left, op, right)
 
 # print
-def p_statement_print(p):
+@yacc.VALUES
+def p_statement_print(_print, expression):
     '''statement_print : PRINT expression '''
-    p[0] = ('print', p[2])
-    # print(p[0])
+    return ('print', expression)
 
-# expressions
-def p_expression_uminus(p):
+# expressions.  Negated constants are folded here; other negated
+# expressions become ('neg', expression) nodes
+@yacc.VALUES
+def p_expression_uminus(_minus, expression):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = -p[2]
+    if isinstance(expression, (int, float)):
+        return -expression
+    return ('neg', expression)
 
 
-def p_expression_group(p):
+@yacc.VALUES
+def p_expression_group(_lparen, expression, _rparen):
     "expression : LPAREN expression RPAREN"
-    p[0] = p[2]
+    return expression
 
 def p_types(p):
     '''type : INTDEC
@@ -174,34 +220,43 @@ def p_empty(p):
 def p_expression_dec(p):
     """expression : FNUMBER
                 | INUMBER
-                | STRING
                 | boolean_dec"""
     p[0] = p[1]
 
-def p_expression_boolean(p):
+# String literals are tagged to tell them apart from variable names
+@yacc.VALUES
+def p_expression_string(value):
+    "expression : STRING"
+    return ('string', value)
+
+@yacc.VALUES
+def p_expression_boolean(value):
     '''boolean_dec : TRUE
                 | FALSE'''
-    if p[1] == "true":
-        p[0] = True
-    elif p[1] == "false":
-        p[0] = False
+    if value == "true":
+        return True
+    elif value == "false":
+        return False
 
 def p_expression_name(p):
     "expression : NAME"
     p[0] = p[1]
 
 # declaration statements 
-def p_statement_declare(p):
+@yacc.VALUES
+def p_statement_declare(var_type, name):
     'statement_declare : type NAME'
-    p[0] = ('declare', p[1] ,p[2])
+    return ('declare', var_type, name)
 
-def p_statement_declare_assign(p):
+@yacc.VALUES
+def p_statement_declare_assign(var_type, name, _assign, expression):
     'statement_declare_assign : type NAME ASSIGN expression'
-    p[0] = ('declare assign', p[1],p[2],p[4])
+    return ('declare assign', var_type, name, expression)
 
-def p_statement_assign(p):
+@yacc.VALUES
+def p_statement_assign(name, _assign, expression):
     'statement_assign : NAME ASSIGN expression'
-    p[0] = ('assign', p[1],p[3])
+    return ('assign', name, expression)
 
 # Control flow statements
 # IF - ELIF - ELSE
@@ -255,13 +310,20 @@ def p_expression_else(p):
 def p_error(p):
     if p:
         print(p)
-        print("Syntax error at line '%s' character '%s' = '%s' " % (p.lineno, p.lexpos, p.value))
+        line, column = lexer.position(p.lexpos)
+        print("Syntax error at line '%s' column '%s' = '%s' " % (line, column, p.value))
     else:
         print("Syntax error at EOF")
 
 
 parser = yacc.yacc()
 
+# Chain rules that only pass on their value, "expression : NAME", "type :
+# INTDEC" and the like, are taken out of the parsing tables altogether.
+# "expression : STRING" and "boolean_dec : TRUE" make a new value and are
+# still reduced.
+parser.collapse_unit_chains()
+
 # while True:
 #     try:
 #         s = input('calc > ')
@@ -271,73 +333,126 @@ parser = yacc.yacc()
 #         continue
 #     yacc.parse(s)
 
-# File
-inputData = []
-file = open("data.txt", "r")
-s = file.read()
-yacc.parse(s)
-
+# Tokens that can begin a statement
+statement_start = {'INTDEC', 'FLOATDEC', 'STRINGDEC', 'BOOLEANDEC', 'NAME', 'PRINT', 'IF', 'FOR', 'WHILE'}
+
+# Split a stream of tokens into the token lists of the top-level statements.
+# A statement ends at a ';' or '}' outside of any parentheses or braces that is
+# followed by a token starting a statement.
+def statement_tokens(tokens):
+    statement = []
+    depth = 0
+    for tok in tokens:
+        if depth == 0 and statement and statement[-1].type in ('FINISH', 'RKEY') \
+           and tok.type in statement_start:
+            yield statement
+            statement = []
+        if tok.type in ('LPAREN', 'LKEY'):
+            depth += 1
+        elif tok.type in ('RPAREN', 'RKEY'):
+            depth -= 1
+        statement.append(tok)
+    if statement:
+        yield statement
+
+# Split a list of tokens into pieces of at least size tokens made of whole
+# top-level statements
+def split_statements(tokens, size):
+    pieces = [[]]
+    for statement in statement_tokens(tokens):
+        if len(pieces[-1]) >= size:
+            pieces.append([])
+        pieces[-1].extend(statement)
+    return pieces
+
+# Parse the top-level statements of a program one at a time, as soon as the
+# lexer has produced all of their tokens, and yield them
+def stream_statements(tokens):
+    for statement in statement_tokens(tokens):
+        result = parser.parse(lexer=lex.TokenStream(statement))
+        if result:
+            yield from result
+
+# Parse a list of tokens.  Long programs are split into runs of top-level
+# statements that are parsed in worker processes.  If any of them has a syntax
+# error, the whole program is parsed again to report it.
+def parse_program(tokens, workers=None, size=20000):
+    global commands
+    workers = workers or os.cpu_count() or 1
+    pieces = split_statements(tokens, max(size, len(tokens) // (workers * 4)))
+    if workers > 1 and len(pieces) > 1:
+        results = yacc.parallel_parse(parser, pieces, workers)
+        if results is not None:
+            commands = tuple(statement for result in results for statement in result)
+            return commands
+    return parser.parse(lexer=lex.TokenStream(tokens))
 
 # ------------------- THREE WAY CODE ------------------- #
 
-results = open("results.txt", "w")
-print("total commands: ",len(commands))
-print("Comandss -----------------------")
-for i in commands:
-    print(i)
-
-label_cont = 1
-var_cont = 1
+# Labels are numbered across the whole program
+code_generator = tac.CodeGenerator(ssa.optimize)
 
 def parse_commands(command):
-    
-    if type(command) is not tuple:
-        return command
-
-    # print(command[0])
-    if command[0] == 'declare':
-        var_type = command[1]
-        name = command[2]
-        return '{}dec ({})'.format(var_type, name)
-
-    elif command[0] == 'declare assign':
-        var_type = command[1]
-        name = command[2]
-        res = ''
-        res += '{}dec ({})\n'.format(var_type, name)
-        tmp_parse = parse_commands(command[3])
-        res += '{} := {}\n'.format(name, command[3])
-        return res
-    
-    elif command[0] == 'assign':
-        name = command[1]
-        tmp_parse = parse_commands(command[2])
-        return '{} := {}\n'.format(name, tmp_parse)
-    
-    elif command[0] == 'print':
-        return 'print ({})'.format(parse_commands(command[0]))
-
-    elif command[0] == 'operation':
-        global label_cont
-        result = ''
-        result += 't{} '.format(label_cont)
-        label_cont += 1
-        result += '{} {} {}'.format(parse_commands(command[1]),command[2],parse_commands(command[3]))
+    return tac.format_code(code_generator.compile([command]))
+
+# Parse a whole program
+def parse_source(source):
+    return parse_program(lex.parallel_tokens(lexer, source, string='"%s"' % string_body.pattern))
+
+# Directory of the code objects of the programs run as Python code
+code_cache = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__', 'programs')
+
+# run is the engine to run the program with: 'python', 'closures' or 'vm'
+def main(stream=False, cfg=False, run=None):
+    # File.  Large files are lexed in worker processes
+    file = open("data.txt", "r")
+    s = file.read()
+
+    if stream:
+        # Generate code for each statement as soon as it's parsed
+        lexer.input(s)
+        with open("results.txt", "w") as results:
+            for command in stream_statements(lexer):
+                results.write('{}\n'.format(parse_commands(command)))
+                results.flush()
+        return
 
-    elif command[0] == 'if':
+    if run == 'python':
+        # Run the program as Python code, compiling it only if it, this file
+        # or the translator changed since an earlier run
+        code = pycode.load(s, parse_source, cache_dir=code_cache,
+                           depends=(__file__, pycode.__file__, tac.__file__))
+        if code is not None:
+            pycode.run(code)
         return
-        
-    elif command[0] == 'condition':
+    if run == 'closures':
+        statements = parse_source(s)
+        if statements is not None:
+            closures.compile_statements(statements).run()
         return
-    
-    elif command[0] == 'for':
+    if run == 'vm':
+        statements = parse_source(s)
+        if statements is not None:
+            vm.compile_statements(statements).fuse().run()
         return
-    
-    elif command[0] == 'while':
-        return
-    
-    else:
-        return 'Error'
 
-for command in commands:
-    print(parse_commands(command))
\ No newline at end of file
+    parse_source(s)
+
+    results = open("results.txt", "w")
+    print("total commands: ",len(commands))
+    print("Comandss -----------------------")
+    for i in commands:
+        print(i)
+
+    if cfg:
+        print(ir.format_cfg(ir.lower(commands, code_generator)))
+    else:
+        print(tac.format_code(code_generator.compile(commands)))
+
+if __name__ == '__main__':
+    # --run runs the program with the default engine, --run=NAME with another
+    run = None
+    for arg in sys.argv[1:]:
+        if arg == '--run' or arg.startswith('--run='):
+            run = arg[6:] or 'python'
+    main(stream='--stream' in sys.argv, cfg='--cfg' in sys.argv, run=run)
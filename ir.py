@@ -0,0 +1,330 @@
+# -----------------------------------------------------------------------------
+# ir.py
+#
+# Control-flow graph of the three-address code generated by tac.py.
+#
+# The instructions of all the blocks are kept in one list, block after block,
+# and block b is code[start[b]:start[b+1]].  Labels are not stored as
+# instructions: labels[b] is the label that starts block b, or None.  A block
+# ends with at most one jump, and falls through to the next block unless that
+# jump is a goto.
+#
+# Everything else is kept in arrays indexed by block number.  The edges are
+# stored in compressed form: the successors of block b are
+# succ[succstart[b]:succstart[b+1]], and likewise for the predecessors.
+# Block 0 is the entry.  Blocks that can't be reached from it have no
+# dominator and belong to no loop.
+# -----------------------------------------------------------------------------
+
+from array import array
+import tac
+
+# Pack a list of lists of block numbers into an index array and an item array
+def _compress(lists):
+    index = array('i', [0])
+    items = array('i')
+    for items_of in lists:
+        items.extend(items_of)
+        index.append(len(items))
+    return index, items
+
+# -----------------------------------------------------------------------------
+# Loop
+#
+# A natural loop.  blocks holds the numbers of its blocks in order, header
+# included, and latches the blocks with a back edge to the header.  parent is
+# the number of the innermost loop containing this one, or -1, and depth is 1
+# for outermost loops.
+# -----------------------------------------------------------------------------
+class Loop(object):
+    def __init__(self, header, latches, blocks, nblocks):
+        self.header = header
+        self.latches = array('i', sorted(latches))
+        self.blocks = array('i', sorted(blocks))
+        self.mask = bytearray(nblocks)
+        for b in self.blocks:
+            self.mask[b] = 1
+        self.parent = -1
+        self.depth = 1
+
+    def __contains__(self, b):
+        return self.mask[b] == 1
+
+    def __repr__(self):
+        return 'Loop(header=%d, blocks=%s)' % (self.header, list(self.blocks))
+
+# -----------------------------------------------------------------------------
+# ControlFlowGraph
+# -----------------------------------------------------------------------------
+class ControlFlowGraph(object):
+    def __init__(self, code=()):
+        blocks = []
+        labels = []
+        for block in tac.basic_blocks(code):
+            if block[0][0] == 'label':
+                labels.append(block[0][2])
+                block = block[1:]
+            else:
+                labels.append(None)
+            blocks.append(block)
+        self.set_blocks(blocks, labels)
+
+    @property
+    def nblocks(self):
+        return len(self.labels)
+
+    # Return the instructions of block b
+    def block(self, b):
+        return self.code[self.start[b]:self.start[b+1]]
+
+    # Return the list of instructions of every block
+    def blocks(self):
+        return [self.block(b) for b in range(self.nblocks)]
+
+    def successors(self, b):
+        return self.succ[self.succstart[b]:self.succstart[b+1]]
+
+    def predecessors(self, b):
+        return self.pred[self.predstart[b]:self.predstart[b+1]]
+
+    def reachable(self, b):
+        return self.idom[b] >= 0
+
+    # Return True if block a dominates block b
+    def dominates(self, a, b):
+        return self.idom[b] >= 0 and self.preorder[a] <= self.preorder[b] < self.preorder[a] + self.domsize[a]
+
+    # Replace all the blocks and analyze the graph again.  Passes that change
+    # the code of the blocks or their jumps finish by calling this.
+    def set_blocks(self, blocks, labels):
+        self.code = []
+        self.start = array('i', [0])
+        for block in blocks:
+            self.code.extend(block)
+            self.start.append(len(self.code))
+        self.labels = list(labels)
+        self.analyze()
+
+    # Remove the blocks that can't be reached from the entry.  A block that
+    # falls through into the next one is reachable only if that one is too, so
+    # removing blocks doesn't change where the others fall through to.
+    def remove_unreachable(self):
+        keep = [b for b in range(self.nblocks) if self.reachable(b)]
+        if len(keep) < self.nblocks:
+            self.set_blocks([self.block(b) for b in keep], [self.labels[b] for b in keep])
+
+    # Make sure the entry block has no predecessors, by adding an empty block
+    # in front of it if the program starts with a loop
+    def split_entry(self):
+        if self.nblocks and self.predecessors(0):
+            self.set_blocks([[]] + self.blocks(), [None] + self.labels)
+
+    # Remove gotos to the block that follows
+    def remove_redundant_jumps(self):
+        blocks = self.blocks()
+        changed = False
+        for b, block in enumerate(blocks[:-1]):
+            if block and block[-1][0] == 'goto' and block[-1][2] == self.labels[b+1]:
+                del block[-1]
+                changed = True
+        if changed:
+            self.set_blocks(blocks, self.labels)
+
+    # Return the code of the graph as a list of instructions.  Labels that no
+    # jump refers to are left out.
+    def linearize(self):
+        targets = {tac.jump_target(ins) for ins in self.code if ins[0] in tac.jump_ops}
+        code = []
+        for b in range(self.nblocks):
+            if self.labels[b] in targets:
+                code.append(('label', None, self.labels[b], None))
+            code.extend(self.block(b))
+        return code
+
+    def analyze(self):
+        self._edges()
+        self._order()
+        self._dominators()
+        self._loops()
+
+    def _edges(self):
+        n = self.nblocks
+        block_of = {label: b for b, label in enumerate(self.labels) if label is not None}
+        succ = []
+        pred = [[] for b in range(n)]
+        for b in range(n):
+            targets = [b + 1] if b + 1 < n else []
+            if self.start[b] < self.start[b+1]:
+                op, _, a, target = self.code[self.start[b+1] - 1]
+                if op == 'goto':
+                    targets = [block_of[a]]
+                elif op in ('iffalse', 'iftrue') and block_of[target] not in targets:
+                    targets.append(block_of[target])
+            succ.append(targets)
+            for s in targets:
+                pred[s].append(b)
+        self.succstart, self.succ = _compress(succ)
+        self.predstart, self.pred = _compress(pred)
+
+    # Depth-first search from the entry.  order holds the reachable blocks in
+    # reverse postorder and rpo[b] is the position of block b in it, or -1.
+    def _order(self):
+        n = self.nblocks
+        post = []
+        seen = bytearray(n)
+        stack = []
+        if n:
+            seen[0] = 1
+            stack.append((0, iter(self.successors(0))))
+        while stack:
+            b, succ = stack[-1]
+            for s in succ:
+                if not seen[s]:
+                    seen[s] = 1
+                    stack.append((s, iter(self.successors(s))))
+                    break
+            else:
+                stack.pop()
+                post.append(b)
+        self.order = array('i', reversed(post))
+        self.rpo = array('i', [-1]) * n
+        for i, b in enumerate(self.order):
+            self.rpo[b] = i
+
+    # Immediate dominators, computed with the iterative algorithm of Cooper,
+    # Harvey and Kennedy.  idom[0] is 0 and idom[b] is -1 for unreachable
+    # blocks.  The dominator tree is then numbered in preorder, so that a
+    # dominates b exactly when b falls in the range of preorder numbers of the
+    # subtree of a.
+    def _dominators(self):
+        n = self.nblocks
+        rpo = self.rpo
+        idom = array('i', [-1]) * n
+        if n:
+            idom[0] = 0
+
+        def intersect(a, b):
+            while a != b:
+                while rpo[a] > rpo[b]:
+                    a = idom[a]
+                while rpo[b] > rpo[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for b in self.order[1:]:
+                new = -1
+                for p in self.predecessors(b):
+                    if idom[p] >= 0:
+                        new = p if new < 0 else intersect(p, new)
+                if idom[b] != new:
+                    idom[b] = new
+                    changed = True
+        self.idom = idom
+
+        children = [[] for b in range(n)]
+        for b in self.order[1:]:
+            children[idom[b]].append(b)
+        self.domstart, self.domchildren = _compress(children)
+
+        self.preorder = array('i', [-1]) * n
+        self.domsize = array('i', [0]) * n
+        stack = [0] if n else []
+        count = 0
+        while stack:
+            b = stack.pop()
+            self.preorder[b] = count
+            count += 1
+            stack.extend(reversed(children[b]))
+        # Children come after their parent in reverse postorder
+        for b in reversed(self.order):
+            self.domsize[b] += 1
+            if b:
+                self.domsize[idom[b]] += self.domsize[b]
+
+    # Return the blocks immediately dominated by block b
+    def dominated(self, b):
+        return self.domchildren[self.domstart[b]:self.domstart[b+1]]
+
+    # Return the dominance frontier of every block, as a list of sets.  The
+    # frontier of b holds the blocks that b doesn't strictly dominate but that
+    # have a predecessor it dominates.
+    def frontiers(self):
+        frontier = [set() for b in range(self.nblocks)]
+        for b in self.order:
+            preds = [p for p in self.predecessors(b) if self.reachable(p)]
+            if len(preds) < 2:
+                continue
+            for p in preds:
+                while p != self.idom[b]:
+                    frontier[p].add(b)
+                    p = self.idom[p]
+        return frontier
+
+    # Natural loops.  An edge from b to a block h that dominates it is a back
+    # edge, and the loop of h is made of h and the blocks that reach b without
+    # going through h.  Back edges to the same header make one loop.  loops is
+    # in reverse postorder of the headers, so outer loops come before the loops
+    # inside them, and loopof[b] is the innermost loop containing block b, or -1.
+    def _loops(self):
+        n = self.nblocks
+        latches = {}
+        for b in self.order:
+            for s in self.successors(b):
+                if self.dominates(s, b):
+                    latches.setdefault(s, []).append(b)
+
+        self.loops = []
+        self.loopof = array('i', [-1]) * n
+        self.loopdepth = array('i', [0]) * n
+        for header in sorted(latches, key=self.rpo.__getitem__):
+            body = {header}
+            stack = list(latches[header])
+            while stack:
+                b = stack.pop()
+                if b not in body:
+                    body.add(b)
+                    stack.extend(p for p in self.predecessors(b) if self.reachable(p))
+            loop = Loop(header, latches[header], body, n)
+            # The innermost loop found so far that contains the header
+            for i in reversed(range(len(self.loops))):
+                if header in self.loops[i]:
+                    loop.parent = i
+                    loop.depth = self.loops[i].depth + 1
+                    break
+            for b in loop.blocks:
+                self.loopof[b] = len(self.loops)
+                self.loopdepth[b] = loop.depth
+            self.loops.append(loop)
+
+# Generate the code for a sequence of statements and return its graph
+def lower(statements, generator=None):
+    generator = generator or tac.CodeGenerator()
+    return ControlFlowGraph(generator.generate(statements))
+
+# -----------------------------------------------------------------------------
+# Formatting
+# -----------------------------------------------------------------------------
+
+def format_cfg(cfg):
+    lines = []
+    for b in range(cfg.nblocks):
+        header = 'B%d' % b
+        if cfg.labels[b] is not None:
+            header += ' (%s)' % tac.format_operand(cfg.labels[b])
+        header += ':'
+        if cfg.reachable(b):
+            if b:
+                header += ' idom B%d' % cfg.idom[b]
+            if cfg.loopdepth[b]:
+                header += ' loop depth %d' % cfg.loopdepth[b]
+        else:
+            header += ' unreachable'
+        succ = ' '.join('B%d' % s for s in cfg.successors(b))
+        if succ:
+            header += ' -> ' + succ
+        lines.append(header)
+        lines.extend('    ' + tac.format_instruction(ins) for ins in cfg.block(b))
+    return '\n'.join(lines)
@@ -0,0 +1,272 @@
+# -----------------------------------------------------------------------------
+# loops.py
+#
+# Loop optimizations on the control-flow graphs in ir.py, done after the
+# passes in ssa.py.
+#
+# tac.CodeGenerator.loop() generates loops with the test at the top, so
+# every iteration runs two jumps:
+#
+#     top:  t := <condition>
+#           ifFalse t goto end
+#           <body>
+#           goto top
+#     end:
+#
+# Such loops are rotated to test at the bottom instead.  The original test
+# guards the entry to the loop, and the empty block after it, the
+# preheader, runs once before the first iteration:
+#
+#           t := <condition>
+#           ifFalse t goto end
+#           <preheader>
+#     top:  <body>
+#           t' := <condition>
+#           ifTrue t' goto top
+#     end:
+#
+# Computations that give the same result in every iteration are then moved
+# to the preheader, and multiplications of induction variables by constants
+# are replaced by additions.  Values computed in the preheader are kept in
+# variables named $1, $2, ..., which can't clash with the names in programs.
+# Loops of other shapes are left alone.
+# -----------------------------------------------------------------------------
+
+import tac
+
+# Return True if x is an integer constant
+def is_int_const(x):
+    return isinstance(x, tac.Const) and type(x.value) is int
+
+# Return the set of names known to hold integers.  Declared types aren't
+# enforced, so a name is only taken to hold integers if every definition of
+# it gives one: declaring it int, copying an integer into it, or +, - or *
+# of integers, or negating one.  Names are assumed to hold integers until a
+# definition shows otherwise, which handles definitions in loops that use
+# the name itself, like i := i + 1.
+def integer_names(code):
+    defs = {}
+    for ins in code:
+        if ins[0] in (':=', 'dec', 'neg') or ins[0] in tac.binary_ops:
+            defs.setdefault(ins[1], []).append(ins)
+    names = set(defs)
+
+    def gives_int(ins):
+        op, dest, a, b = ins
+        if op == 'dec':
+            return a == 'int'
+        if op in (':=', 'neg', '+', '-', '*'):
+            return all(is_int_const(x) or x in names for x in tac.operands(ins))
+        return False
+
+    changed = True
+    while changed:
+        changed = False
+        for name in list(names):
+            if not all(gives_int(ins) for ins in defs[name]):
+                names.discard(name)
+                changed = True
+    return names
+
+# Replace the squares of integers by multiplications
+def reduce_powers(cfg):
+    names = integer_names(cfg.code)
+    for i, (op, dest, a, b) in enumerate(cfg.code):
+        if op == '^' and b == tac.Const(2) and is_int_const(b) and (is_int_const(a) or a in names):
+            cfg.code[i] = ('*', dest, a, a)
+
+# -----------------------------------------------------------------------------
+# LoopOptimizer
+# -----------------------------------------------------------------------------
+class LoopOptimizer(object):
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.temps = max([x for ins in cfg.code for x in (ins[1],) + tac.operands(ins)
+                          if isinstance(x, tac.Temp)], default=0)
+        self.variables = 0
+        self.integers = integer_names(cfg.code)
+
+    def new_temp(self):
+        self.temps += 1
+        return tac.Temp(self.temps)
+
+    def new_variable(self):
+        self.variables += 1
+        return '$%d' % self.variables
+
+    # Optimize all the loops, inner loops first.  Loops are told apart by the
+    # label of their header, which rotation moves to the new header.
+    def optimize(self):
+        cfg = self.cfg
+        done = set()
+        while True:
+            loops = [loop for loop in cfg.loops if cfg.labels[loop.header] not in done]
+            if not loops:
+                break
+            label = cfg.labels[max(loops, key=lambda loop: loop.depth).header]
+            done.add(label)
+            if label is not None and self.rotate(self.loop(label)):
+                self.hoist(self.loop(label))
+                self.reduce(self.loop(label))
+
+    # Return the loop whose header has a label
+    def loop(self, label):
+        return self.cfg.loops[self.cfg.loopof[self.cfg.labels.index(label)]]
+
+    # Return a copy of a list of instructions with new temporaries
+    def copy(self, code):
+        names = {}
+        result = []
+        for ins in code:
+            ins = tac.map_operands(ins, lambda x: names.get(x, x))
+            if isinstance(ins[1], tac.Temp):
+                names[ins[1]] = self.new_temp()
+                ins = (ins[0], names[ins[1]], ins[2], ins[3])
+            result.append(ins)
+        return result
+
+    # Move the test of a loop from the top to the bottom, as shown at the top of
+    # the file.  Returns False if the loop doesn't have the shape of the loops
+    # generated by tac.py.
+    def rotate(self, loop):
+        cfg = self.cfg
+        h = loop.header
+        label = cfg.labels[h]
+        header = cfg.block(h)
+        if len(loop.latches) != 1 or not header or header[-1][0] != 'iffalse':
+            return False
+        latch = loop.latches[0]
+        end = cfg.labels.index(header[-1][3])
+        if latch <= h or end != latch + 1 or h + 1 not in loop or cfg.block(latch)[-1:] != [('goto', None, label, None)]:
+            return False
+        # The test must only compute temporaries, and nothing but the latch
+        # may jump to the header
+        if any(ins[0] not in tac.binary_ops and ins[0] != 'neg' or not isinstance(ins[1], tac.Temp)
+               for ins in header[:-1]):
+            return False
+        if sum(1 for ins in cfg.code if ins[0] in tac.jump_ops and tac.jump_target(ins) == label) != 1:
+            return False
+
+        blocks = cfg.blocks()
+        labels = list(cfg.labels)
+        test = self.copy(header)
+        test[-1] = ('iftrue', None, test[-1][2], label)
+        blocks[latch] = blocks[latch][:-1] + test
+        if labels[h+1] is None:
+            blocks[h:h+1] = [header, []]
+            labels[h:h+2] = [None, None, label]
+        else:
+            blocks[h:h+1] = [header, [], []]
+            labels[h:h+1] = [None, None, label]
+        cfg.set_blocks(blocks, labels)
+        return True
+
+    # Return True if an operation can't raise an error: comparing for
+    # equality, 'and', 'or', and arithmetic other than / and ^ and ordering on
+    # integers
+    def cannot_fail(self, ins):
+        if ins[0] in ('==', '!=', 'and', 'or'):
+            return True
+        return ins[0] in ('+', '-', '*', 'neg', '<', '<=', '>', '>=') and \
+            all(is_int_const(x) or x in self.integers for x in tac.operands(ins))
+
+    # Move the computations of temporaries from operands that don't change in
+    # the loop to the preheader of a rotated loop.  Only the blocks run in
+    # every iteration are looked at, since the preheader runs only if there is
+    # an iteration.  Once something may have been printed in the iteration,
+    # only operations that can't fail are moved, so that errors aren't
+    # reported any earlier than they would have been.
+    def hoist(self, loop):
+        cfg = self.cfg
+        preheader = loop.header - 1
+        latch = loop.latches[0]
+        blocks = cfg.blocks()
+        assigned = {ins[1] for b in loop.blocks for ins in blocks[b] if ins[0] in (':=', 'dec')}
+        hoisted = {}
+        printed = False
+
+        def invariant(x):
+            return isinstance(x, tac.Const) or isinstance(x, str) and x not in assigned
+
+        # Reverse postorder runs through the blocks of an iteration in the
+        # order they can run in
+        for b in cfg.order:
+            if b not in loop:
+                continue
+            every = cfg.dominates(b, latch)
+            kept = []
+            for ins in blocks[b]:
+                ins = tac.map_operands(ins, lambda x: hoisted.get(x, x))
+                op, dest, a, c = ins
+                if every and (op in tac.binary_ops or op == 'neg') and isinstance(dest, tac.Temp) \
+                   and all(invariant(x) for x in tac.operands(ins)) \
+                   and (not printed or self.cannot_fail(ins)):
+                    hoisted[dest] = self.new_variable()
+                    if dest in self.integers:
+                        self.integers.add(hoisted[dest])
+                    blocks[preheader].append((op, hoisted[dest], a, c))
+                else:
+                    kept.append(ins)
+                printed = printed or op == 'print'
+            blocks[b] = kept
+        if hoisted:
+            cfg.set_blocks(blocks, cfg.labels)
+
+    # Strength reduction.  An induction variable is an integer variable
+    # assigned once in the loop, to itself plus or minus a constant.  Its
+    # products with constants are kept in variables that are set in the
+    # preheader and updated right after it.
+    def reduce(self, loop):
+        cfg = self.cfg
+        blocks = cfg.blocks()
+        defs = {}
+        temps = {}
+        for b in loop.blocks:
+            for i, ins in enumerate(blocks[b]):
+                if ins[0] in (':=', 'dec') and isinstance(ins[1], str):
+                    defs.setdefault(ins[1], []).append((b, i))
+                elif isinstance(ins[1], tac.Temp):
+                    temps[ins[1]] = ins
+
+        steps = {}
+        for name, places in defs.items():
+            if name not in self.integers or len(places) != 1:
+                continue
+            b, i = places[0]
+            op, _, t, _ = blocks[b][i]
+            if op != ':=' or t not in temps:
+                continue
+            op, _, x, y = temps[t]
+            if op == '+' and y == name:
+                x, y = y, x
+            if op in ('+', '-') and x == name and is_int_const(y):
+                steps[name] = (op, y.value, b, i)
+
+        reduced = {}
+        for b in loop.blocks:
+            for i, (op, dest, x, y) in enumerate(blocks[b]):
+                if op != '*' or not isinstance(dest, tac.Temp):
+                    continue
+                if isinstance(y, str) and y in steps:
+                    x, y = y, x
+                if isinstance(x, str) and x in steps and is_int_const(y):
+                    if (x, y.value) not in reduced:
+                        reduced[x, y.value] = self.new_variable()
+                    blocks[b][i] = (':=', dest, reduced[x, y.value], None)
+        if not reduced:
+            return
+
+        updates = {}
+        for (name, factor), var in reduced.items():
+            op, step, b, i = steps[name]
+            blocks[loop.header - 1].append(('*', var, name, tac.Const(factor)))
+            updates.setdefault((b, i), []).append((op, var, var, tac.Const(step * factor)))
+        for (b, i) in sorted(updates, reverse=True):
+            blocks[b][i+1:i+1] = updates[b, i]
+        cfg.set_blocks(blocks, cfg.labels)
+
+# Optimize the loops of a control-flow graph
+def optimize(cfg):
+    reduce_powers(cfg)
+    LoopOptimizer(cfg).optimize()
+    return cfg
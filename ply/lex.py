@@ -39,6 +39,11 @@ import types
 import copy
 import os
 import inspect
+import hashlib
+import array
+import bisect
+import functools
+import concurrent.futures
 
 # This tuple contains acceptable string types
 StringTypes = (str, bytes)
@@ -46,6 +51,13 @@ StringTypes = (str, bytes)
 # This regular expression is used to match valid token names
 _is_identifier = re.compile(r'^[a-zA-Z0-9_]+$')
 
+# Default name of the signature file used in optimized mode
+sig_file = 'lexer.sig'
+
+# Maximum number of characters of the input copied into error tokens and
+# LexError exceptions
+error_excerpt = 64
+
 # Exception thrown when invalid token encountered and no default error
 # handler is defined.
 class LexError(Exception):
@@ -58,6 +70,64 @@ class LexToken(object):
     def __repr__(self):
         return f'LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})'
 
+# -----------------------------------------------------------------------------
+# LineIndex
+#
+# This class maps positions in an input string to line and column numbers.  The
+# offsets of the newlines are only collected the first time they are needed.
+# -----------------------------------------------------------------------------
+class LineIndex(object):
+    def __init__(self, data, lineno=1):
+        self.data = data
+        self.lineno = lineno          # Line number of the start of the data
+        self.newlines = None          # Sorted offsets of the newline characters
+        self.bases = []               # Offsets from which lines are renumbered
+        self.changes = []             # Change to the line numbers from each base
+
+    def position(self, lexpos):
+        if self.newlines is None:
+            self.newlines = [m.start() for m in re.finditer('\n', self.data)]
+        n = bisect.bisect_left(self.newlines, lexpos)
+        lineno = self.lineno + n
+        if self.bases:
+            i = bisect.bisect_right(self.bases, lexpos)
+            if i:
+                lineno += self.changes[i - 1]
+        if n:
+            return lineno, lexpos - self.newlines[n - 1]
+        return lineno, lexpos + 1
+
+    # Renumber the lines from lexpos on, so that lexpos is on line lineno
+    def renumber(self, lexpos, lineno):
+        i = bisect.bisect_left(self.bases, lexpos)
+        del self.bases[i:], self.changes[i:]
+        change = lineno - self.position(lexpos)[0]
+        if change:
+            self.bases.append(lexpos)
+            self.changes.append(change + (self.changes[-1] if self.changes else 0))
+
+    # Return a token class whose lineno and column attributes are computed from
+    # lexpos with this index, unless they are set on the token
+    def token_class(self):
+        index = self
+        class LazyLexToken(LexToken):
+            def __getattr__(self, name):
+                if name == 'lineno':
+                    return index.position(self.lexpos)[0]
+                if name == 'column':
+                    return index.position(self.lexpos)[1]
+                raise AttributeError(name)
+        return LazyLexToken
+
+# Token passed to t_error().  Its value is only a short excerpt of the input
+# starting at the illegal character (or the whole run of illegal characters if
+# the lexer was built with bulkerrors).  The rest of the input is available as
+# the text attribute, which is only copied when asked for.
+class LexErrorToken(LexToken):
+    @property
+    def text(self):
+        return self.lexdata[self.lexpos:]
+
 # This object is a stand-in for a logging object created by the
 # logging module.
 
@@ -96,11 +166,15 @@ class Lexer:
         self.lexre = None             # Master regular expression. This is a list of
                                       # tuples (re, findex) where re is a compiled
                                       # regular expression and findex is a list
-                                      # mapping regex group numbers to rules
+                                      # mapping regex group numbers to rules.  Each
+                                      # rule is a tuple (func, type, keywords).
         self.lexretext = None         # Current regular expression strings
         self.lexstatere = {}          # Dictionary mapping lexer states to master regexs
         self.lexstateretext = {}      # Dictionary mapping lexer states to regex strings
         self.lexstaterenames = {}     # Dictionary mapping lexer states to symbol names
+        self.lexdirect = {}           # Characters that form a token by themselves
+        self.lexdispatch = None       # Master regexs for each of the first 256 characters
+        self.lexstatedispatch = {}    # Dictionary mapping lexer states to (direct, dispatch)
         self.lexstate = 'INITIAL'     # Current lexer state
         self.lexstatestack = []       # Stack of lexer states
         self.lexstateinfo = None      # State information
@@ -115,6 +189,13 @@ class Lexer:
         self.lexeoff = None           # EOF rule (if any)
         self.lextokens = None         # List of valid tokens
         self.lexignore = ''           # Ignored characters
+        self.lexignorere = None       # Regex matching a run of ignored characters
+        self.lexstateignorere = {}    # Dictionary of ignored character regexs for each state
+        self.lexnewlines = False      # Count ignored newlines in lineno
+        self.lexbulkerrors = False    # Report runs of illegal characters at once
+        self.lexlazylines = False     # Compute token line numbers on demand
+        self.lextoken = LexToken      # Class of the tokens produced
+        self.lexlineindex = None      # LineIndex of the current input
         self.lexliterals = ''         # Literal characters that can be passed through
         self.lexmodule = None         # Module
         self.lineno = 1               # Current line number
@@ -127,32 +208,51 @@ class Lexer:
         # the lexstatere and lexstateerrorf tables.
 
         if object:
-            newtab = {}
+            c.lexstatere = {}
             for key, ritem in self.lexstatere.items():
-                newre = []
-                for cre, findex in ritem:
-                    newfindex = []
-                    for f in findex:
-                        if not f or not f[0]:
-                            newfindex.append(f)
-                            continue
-                        newfindex.append((getattr(object, f[0].__name__), f[1]))
-                newre.append((cre, newfindex))
-                newtab[key] = newre
-            c.lexstatere = newtab
+                c.lexstatere[key] = _rebind_master_re(ritem, object)
+            c.lexstatedispatch = {}
+            for key, (direct, table) in self.lexstatedispatch.items():
+                rebound = {}
+                newtable = []
+                for ritem in table:
+                    if id(ritem) not in rebound:
+                        rebound[id(ritem)] = _rebind_master_re(ritem, object)
+                    newtable.append(rebound[id(ritem)])
+                c.lexstatedispatch[key] = (direct, newtable)
+            c.lexre = c.lexstatere[c.lexstate]
+            c.lexdirect, c.lexdispatch = c.lexstatedispatch[c.lexstate]
             c.lexstateerrorf = {}
             for key, ef in self.lexstateerrorf.items():
                 c.lexstateerrorf[key] = getattr(object, ef.__name__)
             c.lexmodule = object
         return c
 
+    # Lexers are pickled without their input, so that they can be
+    # sent to worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(lexdata=None, lexlen=0, lexpos=0, lexlineindex=None, lextoken=LexToken)
+        return state
+
     # ------------------------------------------------------------
     # input() - Push a new string into the lexer
     # ------------------------------------------------------------
     def input(self, s):
+        lineno = self.lineno
         self.lexdata = s
         self.lexpos = 0
         self.lexlen = len(s)
+        self.lexlineindex = LineIndex(s, lineno)
+        if self.lexlazylines:
+            self.lextoken = self.lexlineindex.token_class()
+
+    # ------------------------------------------------------------
+    # position() - Return the (line, column) of a position in the
+    # input, both counted from 1
+    # ------------------------------------------------------------
+    def position(self, lexpos):
+        return self.lexlineindex.position(lexpos)
 
     # ------------------------------------------------------------
     # begin() - Changes the lexing state
@@ -162,7 +262,9 @@ class Lexer:
             raise ValueError(f'Undefined state {state!r}')
         self.lexre = self.lexstatere[state]
         self.lexretext = self.lexstateretext[state]
+        self.lexdirect, self.lexdispatch = self.lexstatedispatch[state]
         self.lexignore = self.lexstateignore.get(state, '')
+        self.lexignorere = self.lexstateignorere.get(state, None)
         self.lexerrorf = self.lexstateerrorf.get(state, None)
         self.lexeoff = self.lexstateeoff.get(state, None)
         self.lexstate = state
@@ -205,31 +307,54 @@ class Lexer:
         lexlen    = self.lexlen
         lexignore = self.lexignore
         lexdata   = self.lexdata
+        lexdirect = self.lexdirect
+        lextoken  = self.lextoken
+        lazylines = self.lexlazylines
 
         while lexpos < lexlen:
-            # This code provides some short-circuit code for whitespace, tabs, and other ignored characters
-            if lexdata[lexpos] in lexignore:
-                lexpos += 1
+            # Skip a whole run of whitespace, tabs, and other ignored characters
+            c = lexdata[lexpos]
+            if c in lexignore:
+                end = self.lexignorere.match(lexdata, lexpos).end()
+                if self.lexnewlines and not lazylines:
+                    self.lineno += lexdata.count('\n', lexpos, end)
+                lexpos = end
                 continue
 
-            # Look for a regular expression match
-            for lexre, lexindexfunc in self.lexre:
+            # Characters that form a token by themselves
+            if c in lexdirect:
+                tok = lextoken()
+                tok.value = c
+                tok.type = lexdirect[c]
+                if not lazylines:
+                    tok.lineno = self.lineno
+                tok.lexpos = lexpos
+                self.lexpos = lexpos + 1
+                return tok
+
+            # Look for a regular expression match among the rules that can start with c
+            o = ord(c)
+            for lexre, lexindexfunc in (self.lexdispatch[o] if o < 256 else self.lexre):
                 m = lexre.match(lexdata, lexpos)
                 if not m:
                     continue
 
                 # Create a token for return
-                tok = LexToken()
+                tok = lextoken()
                 tok.value = m.group()
-                tok.lineno = self.lineno
+                if not lazylines:
+                    tok.lineno = self.lineno
                 tok.lexpos = lexpos
 
                 i = m.lastindex
-                func, tok.type = lexindexfunc[i]
+                func, tok.type, keywords = lexindexfunc[i]
 
                 if not func:
                     # If no token type was set, it's an ignored token
                     if tok.type:
+                        # Rules with a keyword table turn reserved words into their own tokens
+                        if keywords:
+                            tok.type = keywords.get(tok.value, tok.type)
                         self.lexpos = m.end()
                         return tok
                     else:
@@ -251,47 +376,93 @@ class Lexer:
                 if not newtok:
                     lexpos    = self.lexpos         # This is here in case user has updated lexpos.
                     lexignore = self.lexignore      # This is here in case there was a state change
+                    lexdirect = self.lexdirect
                     break
                 return newtok
             else:
-                # No match, see if in literals
-                if lexdata[lexpos] in self.lexliterals:
-                    tok = LexToken()
-                    tok.value = lexdata[lexpos]
-                    tok.lineno = self.lineno
-                    tok.type = tok.value
-                    tok.lexpos = lexpos
-                    self.lexpos = lexpos + 1
+                # No match. Look for a literal or call t_error()
+                tok, lexpos = self._unmatched(lexpos)
+                if tok:
                     return tok
+                lexignore = self.lexignore
+                lexdirect = self.lexdirect
 
-                # No match. Call t_error() if defined.
-                if self.lexerrorf:
-                    tok = LexToken()
-                    tok.value = self.lexdata[lexpos:]
-                    tok.lineno = self.lineno
-                    tok.type = 'error'
-                    tok.lexer = self
-                    tok.lexpos = lexpos
-                    self.lexpos = lexpos
-                    newtok = self.lexerrorf(tok)
-                    if lexpos == self.lexpos:
-                        # Error method didn't change text position at all. This is an error.
-                        raise LexError(f"Scanning error. Illegal character {lexdata[lexpos]!r}",
-                                       lexdata[lexpos:])
-                    lexpos = self.lexpos
-                    if not newtok:
-                        continue
-                    return newtok
+        return self._eof(lexpos)
 
-                self.lexpos = lexpos
-                raise LexError(f"Illegal character {lexdata[lexpos]!r} at index {lexpos}",
-                               lexdata[lexpos:])
+    # ------------------------------------------------------------
+    # _unmatched() - Handle a position where no rule matches.  If
+    # the character is a literal, a token is made for it.  Otherwise
+    # t_error() is called.  Returns a tuple (tok, lexpos) with the
+    # token to return (None to keep scanning) and the position to
+    # continue from.
+    # ------------------------------------------------------------
+    def _unmatched(self, lexpos):
+        lexdata = self.lexdata
+
+        # See if in literals
+        if lexdata[lexpos] in self.lexliterals:
+            tok = self.lextoken()
+            tok.value = lexdata[lexpos]
+            if not self.lexlazylines:
+                tok.lineno = self.lineno
+            tok.type = tok.value
+            tok.lexpos = lexpos
+            self.lexpos = lexpos + 1
+            return tok, lexpos + 1
+
+        # Call t_error() if defined.
+        if self.lexerrorf:
+            tok = LexErrorToken()
+            tok.lexdata = lexdata
+            if self.lexbulkerrors:
+                tok.value = lexdata[lexpos:self._error_end(lexpos)]
+            else:
+                tok.value = lexdata[lexpos:lexpos + error_excerpt]
+            tok.lineno = self.position(lexpos)[0] if self.lexlazylines else self.lineno
+            tok.type = 'error'
+            tok.lexer = self
+            tok.lexpos = lexpos
+            self.lexpos = lexpos
+            newtok = self.lexerrorf(tok)
+            if lexpos == self.lexpos:
+                # Error method didn't change text position at all. This is an error.
+                raise LexError(f"Scanning error. Illegal character {lexdata[lexpos]!r}",
+                               lexdata[lexpos:lexpos + error_excerpt])
+            return newtok, self.lexpos
+
+        self.lexpos = lexpos
+        raise LexError(f"Illegal character {lexdata[lexpos]!r} at index {lexpos}",
+                       lexdata[lexpos:lexpos + error_excerpt])
 
+    # ------------------------------------------------------------
+    # _error_end() - Find the end of a run of illegal characters
+    # starting at lexpos.  The run stops at the first character
+    # that is ignored, a literal, or where some rule matches.
+    # ------------------------------------------------------------
+    def _error_end(self, lexpos):
+        lexdata = self.lexdata
+        stop = self.lexignore + self.lexliterals
+        end = lexpos + 1
+        while end < self.lexlen:
+            c = lexdata[end]
+            if c in stop or c in self.lexdirect:
+                break
+            o = ord(c)
+            for lexre, lexindexfunc in (self.lexdispatch[o] if o < 256 else self.lexre):
+                if lexre.match(lexdata, end):
+                    return end
+            end += 1
+        return end
+
+    # ------------------------------------------------------------
+    # _eof() - Handle the end of input, calling t_eof() if defined
+    # ------------------------------------------------------------
+    def _eof(self, lexpos):
         if self.lexeoff:
             tok = LexToken()
             tok.type = 'eof'
             tok.value = ''
-            tok.lineno = self.lineno
+            tok.lineno = self.position(lexpos)[0] if self.lexlazylines else self.lineno
             tok.lexpos = lexpos
             tok.lexer = self
             self.lexpos = lexpos
@@ -313,6 +484,149 @@ class Lexer:
             raise StopIteration
         return t
 
+# -----------------------------------------------------------------------------
+# DFALexer
+#
+# A Lexer that recognizes tokens with a single table-driven DFA for each state
+# instead of the master regular expressions.  The longest match wins.  If two
+# rules match the same text, the first rule wins (function rules come first in
+# the order they were defined, followed by string rules sorted by decreasing
+# regular expression length).  Rules the DFA can't represent are tried with the
+# re module at every position.
+# -----------------------------------------------------------------------------
+
+class DFALexer(Lexer):
+    def __init__(self):
+        Lexer.__init__(self)
+        self.lexdfa = None            # Current (dfa, rules, fallback) tuple
+        self.lexstatedfa = {}         # Dictionary mapping lexer states to DFAs
+
+    def clone(self, object=None):
+        c = Lexer.clone(self, object)
+        if object:
+            c.lexstatedfa = {}
+            for key, (dfa, rules, fallback) in self.lexstatedfa.items():
+                newrules = []
+                for r in rules:
+                    if r[0]:
+                        r = (getattr(object, r[0].__name__),) + r[1:]
+                    newrules.append(r)
+                c.lexstatedfa[key] = (dfa, newrules, fallback)
+            c.lexdfa = c.lexstatedfa[c.lexstate]
+        return c
+
+    def begin(self, state):
+        Lexer.begin(self, state)
+        self.lexdfa = self.lexstatedfa[state]
+
+    # ------------------------------------------------------------
+    # token() - Return the next token from the Lexer
+    # ------------------------------------------------------------
+    def token(self):
+        # Make local copies of frequently referenced attributes
+        lexpos    = self.lexpos
+        lexlen    = self.lexlen
+        lexignore = self.lexignore
+        lexdata   = self.lexdata
+        lexdirect = self.lexdirect
+        lextoken  = self.lextoken
+        lazylines = self.lexlazylines
+        dfa, rules, fallback = self.lexdfa
+        trans     = dfa.trans
+        accept    = dfa.accept
+        asciimap  = dfa.asciimap
+
+        while lexpos < lexlen:
+            c = lexdata[lexpos]
+            if c in lexignore:
+                end = self.lexignorere.match(lexdata, lexpos).end()
+                if self.lexnewlines and not lazylines:
+                    self.lineno += lexdata.count('\n', lexpos, end)
+                lexpos = end
+                continue
+
+            # Characters that form a token by themselves
+            if c in lexdirect:
+                tok = lextoken()
+                tok.value = c
+                tok.type = lexdirect[c]
+                if not lazylines:
+                    tok.lineno = self.lineno
+                tok.lexpos = lexpos
+                self.lexpos = lexpos + 1
+                return tok
+
+            # Run the automaton as far as it goes, remembering the last accepting state
+            state = dfa.start
+            rule = -1
+            end = pos = lexpos
+            while pos < lexlen:
+                o = ord(lexdata[pos])
+                state = trans[state + (asciimap[o] if o < 128 else dfa.classify(lexdata[pos]))]
+                if state < 0:
+                    break
+                pos += 1
+                if accept[state] >= 0:
+                    rule = accept[state]
+                    end = pos
+
+            # Rules outside of the DFA
+            m = None
+            for i, cre in fallback:
+                fm = cre.match(lexdata, lexpos)
+                if fm and (fm.end() > end or (fm.end() == end and (rule < 0 or i < rule))):
+                    rule, end, m = i, fm.end(), fm
+
+            if rule < 0:
+                # No match. Look for a literal or call t_error()
+                tok, lexpos = self._unmatched(lexpos)
+                if tok:
+                    return tok
+                lexignore = self.lexignore
+                lexdirect = self.lexdirect
+                dfa, rules, fallback = self.lexdfa
+                trans, accept, asciimap = dfa.trans, dfa.accept, dfa.asciimap
+                continue
+
+            # Create a token for return
+            tok = lextoken()
+            tok.value = lexdata[lexpos:end]
+            if not lazylines:
+                tok.lineno = self.lineno
+            tok.lexpos = lexpos
+
+            func, tok.type, keywords, cre = rules[rule]
+
+            if not func:
+                # If no token type was set, it's an ignored token
+                if tok.type:
+                    if keywords:
+                        tok.type = keywords.get(tok.value, tok.type)
+                    self.lexpos = end
+                    return tok
+                lexpos = end
+                continue
+
+            # If token is processed by a function, call it
+            tok.lexer = self
+            self.lexmatch = m or cre.fullmatch(lexdata, lexpos, end)
+            self.lexpos = end
+            newtok = func(tok)
+            del tok.lexer
+            del self.lexmatch
+
+            # Every function must return a token, if nothing, we just move to next token
+            if not newtok:
+                lexpos    = self.lexpos         # This is here in case user has updated lexpos.
+                lexignore = self.lexignore      # This is here in case there was a state change
+                lexdirect = self.lexdirect
+                dfa, rules, fallback = self.lexdfa
+                trans, accept, asciimap = dfa.trans, dfa.accept, dfa.asciimap
+                continue
+            return newtok
+
+        return self._eof(lexpos)
+
 # -----------------------------------------------------------------------------
 #                           ==== Lex Builder ===
 #
@@ -347,7 +661,7 @@ def get_caller_module_dict(levels):
 # form the master regular expression.  Given limitations in the Python re
 # module, it may be necessary to break the master regex into separate expressions.
 # -----------------------------------------------------------------------------
-def _form_master_re(relist, reflags, ldict, toknames):
+def _form_master_re(relist, reflags, ldict, toknames, keywords):
     if not relist:
         return [], [], []
     regex = '|'.join(relist)
@@ -361,22 +675,785 @@ def _form_master_re(relist, reflags, ldict, toknames):
         for f, i in lexre.groupindex.items():
             handle = ldict.get(f, None)
             if type(handle) in (types.FunctionType, types.MethodType):
-                lexindexfunc[i] = (handle, toknames[f])
+                lexindexfunc[i] = (handle, toknames[f], None)
                 lexindexnames[i] = f
             elif handle is not None:
                 lexindexnames[i] = f
                 if f.find('ignore_') > 0:
-                    lexindexfunc[i] = (None, None)
+                    lexindexfunc[i] = (None, None, None)
                 else:
-                    lexindexfunc[i] = (None, toknames[f])
+                    lexindexfunc[i] = (None, toknames[f], keywords.get(toknames[f]))
 
         return [(lexre, lexindexfunc)], [regex], [lexindexnames]
     except Exception:
         m = (len(relist) // 2) + 1
-        llist, lre, lnames = _form_master_re(relist[:m], reflags, ldict, toknames)
-        rlist, rre, rnames = _form_master_re(relist[m:], reflags, ldict, toknames)
+        llist, lre, lnames = _form_master_re(relist[:m], reflags, ldict, toknames, keywords)
+        rlist, rre, rnames = _form_master_re(relist[m:], reflags, ldict, toknames, keywords)
         return (llist+rlist), (lre+rre), (lnames+rnames)
 
+# -----------------------------------------------------------------------------
+# LazyLines
+#
+# Lexers built with lazylines.  The line numbers of their tokens come from
+# lexlineindex, which counts every newline in the input, so rules shouldn't
+# count newlines in lineno.  Reading lineno gives the line of lexpos, and
+# assigning it renumbers the lines from lexpos on, for the tokens already
+# returned as well as the ones to come.
+# -----------------------------------------------------------------------------
+
+class LazyLines(object):
+    @property
+    def lineno(self):
+        if self.lexlineindex is None:
+            return self._lineno
+        return self.lexlineindex.position(self.lexpos)[0]
+
+    @lineno.setter
+    def lineno(self, lineno):
+        self._lineno = lineno
+        if self.lexlineindex is not None:
+            self.lexlineindex.renumber(self.lexpos, lineno)
+
+class LazyLinesLexer(LazyLines, Lexer):
+    pass
+
+class LazyLinesDFALexer(LazyLines, DFALexer):
+    pass
+
+# -----------------------------------------------------------------------------
+#                     === Regular Expression Compiler ===
+#
+# The following classes translate the regular expressions of token rules into
+# a deterministic finite automaton (DFA).  Only the regular subset of the re
+# module's syntax is understood: literals, escapes, character classes, groups,
+# alternation and greedy repetition.  Anything else (anchors, lookarounds,
+# backreferences, lazy repetition, inline flags, ...) raises RegexUnsupported
+# and the caller falls back to the re module for that rule.
+# -----------------------------------------------------------------------------
+
+MAXCHAR = sys.maxunicode
+
+class RegexUnsupported(Exception):
+    pass
+
+# Category escapes and the characters they stand for in ASCII mode
+_ascii_categories = {
+    'd': '0123456789',
+    'w': 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_',
+    's': ' \t\n\r\f\v',
+}
+
+# Simple character escapes
+_escapes = {'n': '\n', 't': '\t', 'r': '\r', 'f': '\f', 'v': '\v', 'a': '\a'}
+
+# Return the category flags (digit, word, space) of a character
+def _categories(c, ascii):
+    if ascii:
+        return (c in _ascii_categories['d'], c in _ascii_categories['w'], c in _ascii_categories['s'])
+    return (c.isdecimal(), c.isalnum() or c == '_', c.isspace())
+
+# A set of characters.  ranges is a list of (lo, hi) code point ranges, cats
+# holds the category escapes ('d', 'w', 's', 'D', 'W', 'S') included in the
+# set, and negate inverts the whole set.
+class CharSet(object):
+    def __init__(self, ranges=(), cats='', negate=False):
+        self.ranges = list(ranges)
+        self.cats = cats
+        self.negate = negate
+
+    # Test membership of a character given its code point and its category flags
+    def contains(self, o, flags):
+        found = False
+        for lo, hi in self.ranges:
+            if lo <= o <= hi:
+                found = True
+                break
+        else:
+            for cat in self.cats:
+                if flags['dws'.index(cat.lower())] == cat.islower():
+                    found = True
+                    break
+        return found != self.negate
+
+# -----------------------------------------------------------------------------
+# RegexParser
+#
+# Parses a regular expression into a small tree of tuples:
+#
+#     ('set', charset)         - A single character from a CharSet
+#     ('cat', [node, ...])     - Concatenation
+#     ('alt', [node, ...])     - Alternation
+#     ('rep', node, min, max)  - Greedy repetition (max is None if unbounded)
+#
+# If language is set, lazy repetition is accepted and treated as greedy.  The
+# tree then still describes the set of strings the expression can match, but
+# not which of them the re module would choose.
+# -----------------------------------------------------------------------------
+
+_quantifier = re.compile(r'\{(\d*)(,(\d*))?\}')
+
+class RegexParser(object):
+    def __init__(self, pattern, flags=0, language=False):
+        self.pattern = pattern
+        self.pos = 0
+        self.language = language
+        self.verbose = flags & re.VERBOSE
+        self.ignorecase = flags & re.IGNORECASE
+        self.dotall = flags & re.DOTALL
+
+    def parse(self):
+        node = self.alternation()
+        if self.pos < len(self.pattern):
+            raise RegexUnsupported('unbalanced parenthesis')
+        return node
+
+    # Skip whitespace and comments in verbose mode, then return the next character
+    def peek(self):
+        pattern = self.pattern
+        if self.verbose:
+            while self.pos < len(pattern):
+                c = pattern[self.pos]
+                if c in ' \t\n\r\f\v':
+                    self.pos += 1
+                elif c == '#':
+                    end = pattern.find('\n', self.pos)
+                    self.pos = len(pattern) if end < 0 else end + 1
+                else:
+                    break
+        if self.pos < len(pattern):
+            return pattern[self.pos]
+        return None
+
+    def alternation(self):
+        items = [self.sequence()]
+        while self.peek() == '|':
+            self.pos += 1
+            items.append(self.sequence())
+        return items[0] if len(items) == 1 else ('alt', items)
+
+    def sequence(self):
+        items = []
+        while True:
+            c = self.peek()
+            if c is None or c in '|)':
+                break
+            items.append(self.repeat())
+        return items[0] if len(items) == 1 else ('cat', items)
+
+    def repeat(self):
+        node = self.atom()
+        while True:
+            c = self.peek()
+            if c == '*':
+                lo, hi = 0, None
+                self.pos += 1
+            elif c == '+':
+                lo, hi = 1, None
+                self.pos += 1
+            elif c == '?':
+                lo, hi = 0, 1
+                self.pos += 1
+            elif c == '{':
+                m = _quantifier.match(self.pattern, self.pos)
+                if not m or not (m.group(1) or m.group(3)):
+                    break
+                lo = int(m.group(1) or 0)
+                if m.group(2):
+                    hi = int(m.group(3)) if m.group(3) else None
+                else:
+                    hi = lo
+                self.pos = m.end()
+            else:
+                break
+            if self.peek() == '?' and self.language:
+                self.pos += 1
+            elif self.peek() in ('?', '+'):
+                raise RegexUnsupported('lazy or possessive repetition')
+            node = ('rep', node, lo, hi)
+        return node
+
+    def atom(self):
+        pattern = self.pattern
+        c = self.peek()
+        if c == '(':
+            self.pos += 1
+            if pattern.startswith('?:', self.pos):
+                self.pos += 2
+            elif pattern.startswith('?P<', self.pos):
+                self.pos = pattern.index('>', self.pos) + 1
+            elif pattern.startswith('?', self.pos):
+                raise RegexUnsupported('group extension')
+            node = self.alternation()
+            if self.peek() != ')':
+                raise RegexUnsupported('missing parenthesis')
+            self.pos += 1
+            return node
+        if c == '[':
+            return ('set', self.charclass())
+        if c == '.':
+            self.pos += 1
+            if self.dotall:
+                return ('set', CharSet([(0, MAXCHAR)]))
+            return ('set', CharSet([(10, 10)], negate=True))
+        if c in '^$':
+            raise RegexUnsupported('anchor')
+        if c in '*+?':
+            raise RegexUnsupported('nothing to repeat')
+        if c == '\\':
+            self.pos += 1
+            e = self.escape()
+            if len(e) == 2:
+                return ('set', CharSet(cats=e[1]))
+            return ('set', self.literal(e))
+        self.pos += 1
+        return ('set', self.literal(c))
+
+    # Parse the escape sequence following a backslash.  Category escapes are
+    # returned with their backslash.
+    def escape(self, inclass=False):
+        pattern = self.pattern
+        if self.pos >= len(pattern):
+            raise RegexUnsupported('trailing backslash')
+        c = pattern[self.pos]
+        self.pos += 1
+        if c in 'dwsDWS':
+            return '\\' + c
+        if c in _escapes:
+            return _escapes[c]
+        if c == 'b' and inclass:
+            return '\b'
+        if c in 'xuU':
+            n = {'x': 2, 'u': 4, 'U': 8}[c]
+            digits = pattern[self.pos:self.pos+n]
+            if len(digits) != n:
+                raise RegexUnsupported('bad escape')
+            self.pos += n
+            return chr(int(digits, 16))
+        if c == '0':
+            digits = '0'
+            while len(digits) < 3 and self.pos < len(pattern) and pattern[self.pos] in '01234567':
+                digits += pattern[self.pos]
+                self.pos += 1
+            return chr(int(digits, 8))
+        if c.isalnum():
+            raise RegexUnsupported('escape \\%s' % c)
+        return c
+
+    def charclass(self):
+        pattern = self.pattern
+        self.pos += 1
+        negate = False
+        if pattern.startswith('^', self.pos):
+            negate = True
+            self.pos += 1
+        ranges = []
+        cats = ''
+        first = True
+        while True:
+            if self.pos >= len(pattern):
+                raise RegexUnsupported('unterminated character set')
+            c = pattern[self.pos]
+            if c == ']' and not first:
+                self.pos += 1
+                break
+            first = False
+            if pattern.startswith('[:', self.pos) or pattern.startswith('--', self.pos) or \
+               pattern.startswith('&&', self.pos) or pattern.startswith('~~', self.pos):
+                raise RegexUnsupported('set operation')
+            self.pos += 1
+            if c == '\\':
+                c = self.escape(inclass=True)
+                if len(c) == 2:
+                    cats += c[1]
+                    continue
+            if pattern.startswith('-', self.pos) and not pattern.startswith('-]', self.pos):
+                self.pos += 1
+                hi = pattern[self.pos]
+                self.pos += 1
+                if hi == '\\':
+                    hi = self.escape(inclass=True)
+                    if len(hi) == 2:
+                        raise RegexUnsupported('bad character range')
+                if ord(hi) < ord(c):
+                    raise RegexUnsupported('bad character range')
+                ranges.append((ord(c), ord(hi)))
+            else:
+                ranges.append((ord(c), ord(c)))
+        if self.ignorecase:
+            ranges = self.foldcase(ranges)
+        return CharSet(ranges, cats, negate)
+
+    def literal(self, c):
+        ranges = [(ord(c), ord(c))]
+        if self.ignorecase:
+            ranges = self.foldcase(ranges)
+        return CharSet(ranges)
+
+    # Add the other case of the ASCII letters in a list of ranges.  Case folding
+    # of other characters is not supported.
+    def foldcase(self, ranges):
+        extra = []
+        for lo, hi in ranges:
+            if hi > 127:
+                raise RegexUnsupported('case folding of non-ASCII characters')
+            for o in range(lo, min(hi, 127) + 1):
+                c = chr(o)
+                if c.isalpha():
+                    extra.append((ord(c.swapcase()), ord(c.swapcase())))
+        return ranges + extra
+
+# -----------------------------------------------------------------------------
+# DFA
+#
+# This class builds a minimized DFA that recognizes a list of regular
+# expressions at once.  The input alphabet is first split into character
+# classes, characters that no expression can tell apart.  ASCII characters are
+# mapped to their class with a simple table.  All other characters are split
+# into intervals by the ranges used in the expressions and further by their
+# categories, and are classified on demand.
+#
+# The automaton is stored in two flat arrays.  A state is the offset of its row
+# in trans, so the next state is trans[state + cls], or -1 if no expression can
+# match any further.  accept[state] is the index of the highest priority (first)
+# expression matched when the automaton stops in that state, or -1.
+#
+# conflicts records each pair of expressions (i, j) for which some string
+# matched by i is a prefix of a string matched by j or the other way around,
+# that is, expressions that can both match at the same position in the input.
+# -----------------------------------------------------------------------------
+
+class DFA(object):
+    def __init__(self, nodes, flags=0):
+        self.ascii = bool(flags & re.ASCII)
+        self.charsets = []
+        for node in nodes:
+            self.collect(node)
+        self.make_classes()
+
+        # Build a nondeterministic automaton for all of the expressions.  Each
+        # expression has its own start state reached from state 0.
+        self.nfa_eps = [[]]
+        self.nfa_edges = [[]]
+        self.nfa_rule = [-1]
+        self.nfa_final = {}
+        for rule, node in enumerate(nodes):
+            start, end = self.nfa(node, rule)
+            self.nfa_eps[0].append(start)
+            self.nfa_final[end] = rule
+
+        self.make_dfa()
+        self.minimize()
+
+    # Collect all of the character sets used by an expression
+    def collect(self, node):
+        kind = node[0]
+        if kind == 'set':
+            self.charsets.append(node[1])
+        elif kind == 'rep':
+            self.collect(node[1])
+        else:
+            for n in node[1]:
+                self.collect(n)
+
+    # Split the input alphabet into character classes
+    def make_classes(self):
+        charsets = self.charsets
+        signatures = {}
+
+        def classify(o, flags):
+            sig = tuple([cs.contains(o, flags) for cs in charsets])
+            return signatures.setdefault(sig, len(signatures))
+
+        self.asciimap = [classify(o, _categories(chr(o), self.ascii)) for o in range(128)]
+
+        # Split the other characters into intervals at every range boundary
+        bounds = {128}
+        for cs in charsets:
+            for lo, hi in cs.ranges:
+                if lo > 128:
+                    bounds.add(lo)
+                if 128 < hi + 1 <= MAXCHAR:
+                    bounds.add(hi + 1)
+        self.bounds = sorted(bounds)
+
+        if self.ascii:
+            combos = [(False, False, False)]
+        else:
+            combos = [(False, False, False), (False, True, False), (True, True, False), (False, False, True)]
+        self.othermap = {}
+        for i, lo in enumerate(self.bounds):
+            for flags in combos:
+                self.othermap[i, flags] = classify(lo, flags)
+
+        self.nclasses = len(signatures)
+        self.cache = {}
+
+    # Return the character class of a non-ASCII character
+    def classify(self, c):
+        cls = self.cache.get(c)
+        if cls is None:
+            i = bisect.bisect_right(self.bounds, ord(c)) - 1
+            cls = self.cache[c] = self.othermap[i, _categories(c, self.ascii)]
+        return cls
+
+    # Return the set of character classes matched by a character set
+    def classes(self, cs):
+        result = set()
+        for o, cls in enumerate(self.asciimap):
+            if cls not in result and cs.contains(o, _categories(chr(o), self.ascii)):
+                result.add(cls)
+        for (i, flags), cls in self.othermap.items():
+            if cls not in result and cs.contains(self.bounds[i], flags):
+                result.add(cls)
+        return frozenset(result)
+
+    def new_state(self, rule):
+        self.nfa_eps.append([])
+        self.nfa_edges.append([])
+        self.nfa_rule.append(rule)
+        return len(self.nfa_eps) - 1
+
+    # Thompson construction.  Returns the start and end states of a fragment
+    # recognizing node.
+    def nfa(self, node, rule):
+        kind = node[0]
+        start = self.new_state(rule)
+        if kind == 'set':
+            end = self.new_state(rule)
+            self.nfa_edges[start].append((self.classes(node[1]), end))
+        elif kind == 'cat':
+            end = start
+            for n in node[1]:
+                s, e = self.nfa(n, rule)
+                self.nfa_eps[end].append(s)
+                end = e
+        elif kind == 'alt':
+            end = self.new_state(rule)
+            for n in node[1]:
+                s, e = self.nfa(n, rule)
+                self.nfa_eps[start].append(s)
+                self.nfa_eps[e].append(end)
+        else:
+            _, sub, lo, hi = node
+            end = start
+            for i in range(lo):
+                s, e = self.nfa(sub, rule)
+                self.nfa_eps[end].append(s)
+                end = e
+            if hi is None:
+                s, e = self.nfa(sub, rule)
+                self.nfa_eps[end].append(s)
+                self.nfa_eps[e].append(s)
+                self.nfa_eps[s].append(e)
+                end = e
+            else:
+                final = self.new_state(rule)
+                for i in range(hi - lo):
+                    s, e = self.nfa(sub, rule)
+                    self.nfa_eps[end].append(s)
+                    self.nfa_eps[end].append(final)
+                    end = e
+                self.nfa_eps[end].append(final)
+                end = final
+        return start, end
+
+    def closure(self, states):
+        stack = list(states)
+        result = set(states)
+        eps = self.nfa_eps
+        while stack:
+            for t in eps[stack.pop()]:
+                if t not in result:
+                    result.add(t)
+                    stack.append(t)
+        return frozenset(result)
+
+    # Subset construction
+    def make_dfa(self):
+        edges = self.nfa_edges
+        final = self.nfa_final
+        rule_of = self.nfa_rule
+        start = self.closure([0])
+        ids = {start: 0}
+        todo = [start]
+        self.dfa_trans = []
+        self.dfa_accept = []
+        self.conflicts = set()
+        while todo:
+            S = todo.pop(0)
+            moves = {}
+            for s in S:
+                for cls, t in edges[s]:
+                    for c in cls:
+                        moves.setdefault(c, set()).add(t)
+            row = [-1] * self.nclasses
+            for c, targets in moves.items():
+                T = self.closure(targets)
+                if T not in ids:
+                    ids[T] = len(ids)
+                    todo.append(T)
+                row[c] = ids[T]
+            self.dfa_trans.append(row)
+
+            accepted = {final[s] for s in S if s in final}
+            self.dfa_accept.append(min(accepted) if accepted else -1)
+            alive = {rule_of[s] for s in S}
+            for i in accepted:
+                for j in alive:
+                    if i != j and j >= 0:
+                        self.conflicts.add((min(i, j), max(i, j)))
+
+    # Moore's partition refinement algorithm, followed by the construction of
+    # the flat transition arrays
+    def minimize(self):
+        n = len(self.dfa_trans)
+        block = list(self.dfa_accept)
+        nblocks = -1
+        while True:
+            keys = {}
+            newblock = []
+            for s in range(n):
+                key = (block[s],) + tuple([block[t] if t >= 0 else None for t in self.dfa_trans[s]])
+                newblock.append(keys.setdefault(key, len(keys)))
+            block = newblock
+            if len(keys) == nblocks:
+                break
+            nblocks = len(keys)
+
+        # Number the states so that the start state comes first
+        order = {}
+        for s in range(n):
+            if block[s] not in order:
+                order[block[s]] = len(order)
+        nclasses = self.nclasses
+        self.trans = array.array('i', [-1]) * (nblocks * nclasses)
+        self.accept = array.array('i', [-1]) * (nblocks * nclasses)
+        for s in range(n):
+            row = order[block[s]] * nclasses
+            self.accept[row] = self.dfa_accept[s]
+            for c, t in enumerate(self.dfa_trans[s]):
+                if t >= 0:
+                    self.trans[row + c] = order[block[t]] * nclasses
+        self.start = 0
+        self.nstates = nblocks
+        del self.dfa_trans, self.nfa_eps, self.nfa_edges, self.nfa_rule
+
+    # Run the automaton on data starting at pos.  Returns a tuple (rule, end)
+    # for the longest match, or (-1, pos) if nothing matches.
+    def match(self, data, pos, endpos=None):
+        if endpos is None:
+            endpos = len(data)
+        trans = self.trans
+        accept = self.accept
+        asciimap = self.asciimap
+        state = self.start
+        rule = -1
+        end = pos
+        while pos < endpos:
+            c = data[pos]
+            o = ord(c)
+            state = trans[state + (asciimap[o] if o < 128 else self.classify(c))]
+            if state < 0:
+                break
+            pos += 1
+            if accept[state] >= 0:
+                rule = accept[state]
+                end = pos
+        return rule, end
+
+# -----------------------------------------------------------------------------
+# _form_master_dfa()
+#
+# Build the DFA used by DFALexer for a list of (name, regex) rules.  Returns a
+# tuple (dfa, rules, fallback).  rules has an entry (func, type, keywords, re)
+# for each rule, where re is the compiled regex of the rule alone.  Rules that
+# the DFA can't handle are listed in fallback as (index, re) and are matched
+# with the re module instead.
+# -----------------------------------------------------------------------------
+def _form_master_dfa(rulelist, reflags, ldict, toknames, keywords):
+    nodes = []
+    rules = []
+    fallback = []
+    for i, (name, regex) in enumerate(rulelist):
+        cre = re.compile('(?P<%s>%s)' % (name, regex), reflags)
+        handle = ldict.get(name, None)
+        if type(handle) in (types.FunctionType, types.MethodType):
+            rules.append((handle, toknames[name], None, cre))
+        elif name.find('ignore_') > 0:
+            rules.append((None, None, None, cre))
+        else:
+            rules.append((None, toknames[name], keywords.get(toknames[name]), cre))
+        try:
+            nodes.append(RegexParser(regex, reflags).parse())
+        except RegexUnsupported:
+            # A rule that can never match keeps the indices of the others intact
+            nodes.append(('set', CharSet()))
+            fallback.append((i, cre))
+    return DFA(nodes, reflags), rules, fallback
+
+# -----------------------------------------------------------------------------
+# _first_charsets()
+#
+# Returns a tuple (charsets, nullable) with the character sets that can match
+# the first character of a regular expression tree from RegexParser, and a
+# flag telling whether it can match the empty string.
+# -----------------------------------------------------------------------------
+def _first_charsets(node):
+    kind = node[0]
+    if kind == 'set':
+        return [node[1]], False
+    if kind == 'rep':
+        charsets, nullable = _first_charsets(node[1])
+        return charsets, nullable or node[2] == 0
+    charsets = []
+    if kind == 'alt':
+        nullable = False
+        for n in node[1]:
+            c, nl = _first_charsets(n)
+            charsets.extend(c)
+            nullable = nullable or nl
+        return charsets, nullable
+    for n in node[1]:
+        c, nl = _first_charsets(n)
+        charsets.extend(c)
+        if not nl:
+            return charsets, False
+    return charsets, True
+
+# -----------------------------------------------------------------------------
+# _form_dispatch()
+#
+# Build the first character dispatch tables for a list of (name, regex) rules.
+# Returns a tuple (direct, table).  table has an entry for each of the first
+# 256 characters with a list of master regexes built from only the rules that
+# can start with that character, in the format returned by _form_master_re().
+# direct maps characters that always form a token by themselves to the type of
+# that token.  This is the case when the only rule that can start with the
+# character is a string rule matching a single character, or when no rule can
+# start with it and it's a literal.
+# -----------------------------------------------------------------------------
+def _form_dispatch(rulelist, reflags, ldict, toknames, keywords, literals):
+    chars = [chr(o) for o in range(256)]
+    ascii = bool(reflags & re.ASCII)
+    flags = [_categories(c, ascii) for c in chars]
+
+    # For every character, find the rules that can start with it
+    starts = [[] for c in chars]
+    single = set()
+    for i, (name, regex) in enumerate(rulelist):
+        try:
+            node = RegexParser(regex, reflags, language=True).parse()
+            charsets, nullable = _first_charsets(node)
+        except RegexUnsupported:
+            node = None
+            nullable = True
+        if node and node[0] == 'set' and not callable(ldict.get(name)) and name.find('ignore_') < 0 \
+           and toknames[name] not in keywords:
+            single.add(i)
+        for o in range(256):
+            if nullable or any(cs.contains(o, flags[o]) for cs in charsets):
+                starts[o].append(i)
+
+    direct = {}
+    table = []
+    masters = {}
+    for o, rules in enumerate(starts):
+        if len(rules) == 1 and rules[0] in single:
+            direct[chars[o]] = toknames[rulelist[rules[0]][0]]
+        elif not rules and chars[o] in literals:
+            direct[chars[o]] = chars[o]
+        key = tuple(rules)
+        if key not in masters:
+            relist = ['(?P<%s>%s)' % rulelist[i] for i in rules]
+            masters[key] = _form_master_re(relist, reflags, ldict, toknames, keywords)[0]
+        table.append(masters[key])
+    return direct, table
+
+# -----------------------------------------------------------------------------
+# _profile_order()
+#
+# Reorder a list of (name, regex) rules so that the rules with the highest
+# counts in profile come first.  Rules that can match at the same position in
+# some input keep their relative order, so the rule that wins a match is never
+# changed.  Rules the DFA can't represent keep their place relative to all the
+# others.
+# -----------------------------------------------------------------------------
+def _profile_order(rulelist, reflags, profile):
+    nodes = []
+    fixed = set()
+    for i, (name, regex) in enumerate(rulelist):
+        try:
+            nodes.append(RegexParser(regex, reflags, language=True).parse())
+        except RegexUnsupported:
+            nodes.append(('set', CharSet()))
+            fixed.add(i)
+    conflicts = DFA(nodes, reflags).conflicts
+
+    # For every rule, the rules that have to stay in front of it
+    before = [set() for rule in rulelist]
+    for j in range(len(rulelist)):
+        for i in range(j):
+            if (i, j) in conflicts or i in fixed or j in fixed:
+                before[j].add(i)
+
+    order = []
+    placed = set()
+    while len(order) < len(rulelist):
+        ready = [i for i in range(len(rulelist)) if i not in placed and before[i] <= placed]
+        i = min(ready, key=lambda i: (-profile.get(rulelist[i][0], 0), i))
+        order.append(i)
+        placed.add(i)
+    return [rulelist[i] for i in order]
+
+# -----------------------------------------------------------------------------
+# _counting_rules()
+#
+# Returns a copy of ldict in which each of the rules named in rulenames is
+# replaced by a function that counts its matches in counts and then does what
+# the rule would have done.
+# -----------------------------------------------------------------------------
+def _counting_rules(ldict, rulenames, toknames, keywords, counts):
+    ldict = dict(ldict)
+    for name in rulenames:
+        ldict[name] = _counting_rule(name, ldict[name], keywords.get(toknames[name]), counts)
+    return ldict
+
+def _counting_rule(name, handle, keywords, counts):
+    counts[name] = 0
+    if callable(handle):
+        def rule(t):
+            counts[name] += 1
+            return handle(t)
+        rule.__name__ = handle.__name__
+    elif name.find('ignore_') > 0:
+        def rule(t):
+            counts[name] += 1
+    else:
+        def rule(t):
+            counts[name] += 1
+            if keywords:
+                t.type = keywords.get(t.value, t.type)
+            return t
+    return rule
+
+# -----------------------------------------------------------------------------
+# _rebind_master_re()
+#
+# Returns a copy of a list of master regexes from _form_master_re() with the
+# rule functions replaced by the methods of the same name in object.
+# -----------------------------------------------------------------------------
+def _rebind_master_re(lexre, object):
+    newre = []
+    for cre, findex in lexre:
+        newfindex = []
+        for f in findex:
+            if not f or not f[0]:
+                newfindex.append(f)
+                continue
+            newfindex.append((getattr(object, f[0].__name__),) + f[1:])
+        newre.append((cre, newfindex))
+    return newre
+
 # -----------------------------------------------------------------------------
 # def _statetoken(s,names)
 #
@@ -426,14 +1503,32 @@ class LexerReflect(object):
         self.get_literals()
         self.get_states()
         self.get_rules()
+        self.get_keywords()
+        self.get_profile()
 
     # Validate all of the information
     def validate_all(self):
         self.validate_tokens()
         self.validate_literals()
         self.validate_rules()
+        self.validate_keywords()
+        self.validate_profile()
         return self.error
 
+    # Compute a signature over the lexer specification
+    def signature(self):
+        parts = [' '.join(self.tokens), repr(self.literals), repr(self.stateinfo), str(self.reflags)]
+        for state in self.stateinfo:
+            for fname, f in self.funcsym[state]:
+                parts.append('%s:%s:%s' % (state, fname, _get_regex(f)))
+            for name, r in self.strsym[state]:
+                parts.append('%s:%s:%s' % (state, name, r))
+        for state, ignore in self.ignore.items():
+            parts.append('%s:ignore:%r' % (state, ignore))
+        parts.append(repr(self.keywords))
+        parts.append(repr(self.profile))
+        return '\n'.join(parts)
+
     # Get the tokens map
     def get_tokens(self):
         tokens = self.ldict.get('tokens', None)
@@ -579,6 +1674,60 @@ class LexerReflect(object):
         for s in self.strsym.values():
             s.sort(key=lambda x: len(x[1]), reverse=True)
 
+    # Get the keyword tables.  This is a dictionary mapping the name of a token
+    # to a dictionary of reserved words.  Whenever a rule for that token matches
+    # one of the reserved words, the token type is taken from the table instead.
+    def get_keywords(self):
+        self.keywords = self.ldict.get('keywords', None) or {}
+
+    # Validate the keyword tables
+    def validate_keywords(self):
+        if not isinstance(self.keywords, dict):
+            self.log.error('keywords must be a dictionary')
+            self.error = True
+            return
+
+        for tokname, table in self.keywords.items():
+            if not isinstance(table, dict):
+                self.log.error('Keyword table for token %r must be a dictionary', tokname)
+                self.error = True
+                continue
+
+            rules = [name for names in self.strsym.values() for name, r in names
+                     if self.toknames[name] == tokname]
+            funcs = [fname for names in self.funcsym.values() for fname, f in names
+                     if self.toknames[fname] == tokname]
+            if funcs:
+                self.log.error('Keyword table for token %r requires its rule to be defined as a string', tokname)
+                self.error = True
+            elif not rules:
+                self.log.error('Keyword table defined for token %r, but there is no rule for it', tokname)
+                self.error = True
+
+            for word, kwtype in table.items():
+                if kwtype not in self.tokens:
+                    self.log.error('Keyword %r defined for an unspecified token %s', word, kwtype)
+                    self.error = True
+
+    # Get the rule profile.  This is a dictionary mapping the names of rules
+    # to the number of times they matched in some sample input.
+    def get_profile(self):
+        self.profile = self.ldict.get('lexprofile', None) or {}
+
+    # Validate the rule profile
+    def validate_profile(self):
+        if not isinstance(self.profile, dict):
+            self.log.error('lexprofile must be a dictionary')
+            self.error = True
+            return
+
+        for name, count in self.profile.items():
+            if name not in self.toknames:
+                self.log.warning('lexprofile has a count for an undefined rule %r', name)
+            if not isinstance(count, int):
+                self.log.error('lexprofile count for rule %r must be an integer', name)
+                self.error = True
+
     # Validate all of the t_rules collected
     def validate_rules(self):
         for state in self.stateinfo:
@@ -709,19 +1858,73 @@ class LexerReflect(object):
                     self.error = True
             linen += 1
 
+# -----------------------------------------------------------------------------
+# read_signatures()
+# write_signature()
+#
+# In optimized mode, the digest of every lexer specification or grammar that
+# has passed validation is appended to a small signature file.  A later build
+# of the same specification finds its digest there and skips the validation
+# step.  yacc.py uses these for grammars too.  Unless another file is given,
+# the signature file goes in the directory of the module that holds the
+# specification, not in the directory the program happens to run from.
+# -----------------------------------------------------------------------------
+
+def signature_file(pdict, name):
+    srcfile = pdict.get('__file__')
+    if not srcfile:
+        return name
+    return os.path.join(os.path.dirname(srcfile), name)
+
+def signature_digest(signature):
+    return hashlib.sha256(signature.encode('utf-8')).hexdigest()
+
+def read_signatures(sigfile):
+    try:
+        with open(sigfile) as f:
+            return set(f.read().split())
+    except IOError:
+        return set()
+
+def write_signature(sigfile, digest, errorlog):
+    try:
+        with open(sigfile, 'a') as f:
+            f.write(digest + '\n')
+    except IOError as e:
+        errorlog.warning("Couldn't write %r. %s", sigfile, e)
+
 # -----------------------------------------------------------------------------
 # lex(module)
 #
-# Build all of the regular expression rules from definitions in the supplied module
+# Build all of the regular expression rules from definitions in the supplied module.
+# If optimize is set, a specification whose signature is found in sigfile is
+# trusted as-is and none of the rules or source modules are validated again.
+# sigfile defaults to lexer.sig in the directory of the specification module.
+# If dfa is set, a DFALexer is returned that matches tokens with a DFA.  If
+# newlines is set, newlines in the ignored characters are counted in lineno.
+# If bulkerrors is set, t_error() is called once for a whole run of illegal
+# characters, passed as the token value, and should skip all of it.  If
+# lazylines is set, tokens don't store a line number.  Their lineno and column
+# are computed from lexpos only when used (see LazyLines).
+#
+# If instrument is set, the lexer counts the matches of each rule in its
+# lexprofile dictionary.  Counts like these can be given back as profile (or
+# as a lexprofile dictionary in the specification) to try the most frequent
+# rules first.
 # -----------------------------------------------------------------------------
 def lex(*, module=None, object=None, debug=False, 
-        reflags=int(re.VERBOSE), debuglog=None, errorlog=None):
+        reflags=int(re.VERBOSE), debuglog=None, errorlog=None,
+        optimize=False, sigfile=None, dfa=False, newlines=False,
+        bulkerrors=False, lazylines=False, instrument=False, profile=None):
 
     global lexer
 
     ldict = None
     stateinfo  = {'INITIAL': 'inclusive'}
-    lexobj = Lexer()
+    if lazylines:
+        lexobj = LazyLinesDFALexer() if dfa else LazyLinesLexer()
+    else:
+        lexobj = DFALexer() if dfa else Lexer()
     global token, input
 
     if errorlog is None:
@@ -748,8 +1951,20 @@ def lex(*, module=None, object=None, debug=False,
     # Collect parser information from the dictionary
     linfo = LexerReflect(ldict, log=errorlog, reflags=reflags)
     linfo.get_all()
-    if linfo.validate_all():
-        raise SyntaxError("Can't build lexer")
+
+    # In optimized mode, look for a previously validated signature
+    validated = False
+    if optimize and not linfo.error:
+        if sigfile is None:
+            sigfile = signature_file(ldict, sig_file)
+        digest = signature_digest(linfo.signature())
+        validated = digest in read_signatures(sigfile)
+
+    if not validated:
+        if linfo.validate_all():
+            raise SyntaxError("Can't build lexer")
+        if optimize:
+            write_signature(sigfile, digest, errorlog)
 
     # Dump some basic debugging information
     if debug:
@@ -773,24 +1988,38 @@ def lex(*, module=None, object=None, debug=False,
     # Get the stateinfo dictionary
     stateinfo = linfo.stateinfo
 
+    # In instrumented mode, every rule counts its matches in lexprofile
+    lexobj.lexprofile = {}
+    if instrument:
+        rulenames = set()
+        for state in stateinfo:
+            rulenames.update(name for name, f in linfo.funcsym[state])
+            rulenames.update(name for name, r in linfo.strsym[state])
+        ldict = _counting_rules(ldict, rulenames, linfo.toknames, linfo.keywords, lexobj.lexprofile)
+
+    if profile is None:
+        profile = linfo.profile
+
     regexs = {}
+    rulelists = {}
     # Build the master regular expressions
     for state in stateinfo:
-        regex_list = []
+        # Add rules defined by functions first, then all of the simple rules
+        rule_list = [(fname, _get_regex(f)) for fname, f in linfo.funcsym[state]]
+        rule_list.extend(linfo.strsym[state])
 
-        # Add rules defined by functions first
-        for fname, f in linfo.funcsym[state]:
-            regex_list.append('(?P<%s>%s)' % (fname, _get_regex(f)))
-            if debug:
-                debuglog.info("lex: Adding rule %s -> '%s' (state '%s')", fname, _get_regex(f), state)
+        # Try the most frequent rules first where that can't change the result
+        if profile:
+            rule_list = _profile_order(rule_list, reflags, profile)
 
-        # Now add all of the simple rules
-        for name, r in linfo.strsym[state]:
+        regex_list = []
+        for name, r in rule_list:
             regex_list.append('(?P<%s>%s)' % (name, r))
             if debug:
                 debuglog.info("lex: Adding rule %s -> '%s' (state '%s')", name, r, state)
 
         regexs[state] = regex_list
+        rulelists[state] = rule_list
 
     # Build the master regular expressions
 
@@ -798,7 +2027,7 @@ def lex(*, module=None, object=None, debug=False,
         debuglog.info('lex: ==== MASTER REGEXS FOLLOW ====')
 
     for state in regexs:
-        lexre, re_text, re_names = _form_master_re(regexs[state], reflags, ldict, linfo.toknames)
+        lexre, re_text, re_names = _form_master_re(regexs[state], reflags, ldict, linfo.toknames, linfo.keywords)
         lexobj.lexstatere[state] = lexre
         lexobj.lexstateretext[state] = re_text
         lexobj.lexstaterenames[state] = re_names
@@ -812,10 +2041,32 @@ def lex(*, module=None, object=None, debug=False,
             lexobj.lexstatere[state].extend(lexobj.lexstatere['INITIAL'])
             lexobj.lexstateretext[state].extend(lexobj.lexstateretext['INITIAL'])
             lexobj.lexstaterenames[state].extend(lexobj.lexstaterenames['INITIAL'])
+            rulelists[state].extend(rulelists['INITIAL'])
+
+    # Build the first character dispatch tables
+    for state in stateinfo:
+        lexobj.lexstatedispatch[state] = _form_dispatch(rulelists[state], reflags, ldict, linfo.toknames,
+                                                        linfo.keywords, lexobj.lexliterals)
+        if debug:
+            debuglog.info("lex: state '%s' : direct tokens = %r", state, ''.join(sorted(lexobj.lexstatedispatch[state][0])))
+
+    # Build the DFAs
+    if dfa:
+        for state in stateinfo:
+            lexobj.lexstatedfa[state] = _form_master_dfa(rulelists[state], reflags, ldict, linfo.toknames, linfo.keywords)
+            if debug:
+                sdfa, rules, fallback = lexobj.lexstatedfa[state]
+                debuglog.info("lex: state '%s' : dfa with %d states, %d character classes",
+                              state, sdfa.nstates, sdfa.nclasses)
+                for i, cre in fallback:
+                    debuglog.info("lex: state '%s' : rule %s matched with the re module",
+                                  state, rulelists[state][i][0])
+        lexobj.lexdfa = lexobj.lexstatedfa['INITIAL']
 
     lexobj.lexstateinfo = stateinfo
     lexobj.lexre = lexobj.lexstatere['INITIAL']
     lexobj.lexretext = lexobj.lexstateretext['INITIAL']
+    lexobj.lexdirect, lexobj.lexdispatch = lexobj.lexstatedispatch['INITIAL']
     lexobj.lexreflags = reflags
 
     # Set up ignore variables
@@ -845,6 +2096,15 @@ def lex(*, module=None, object=None, debug=False,
             if s not in linfo.ignore:
                 linfo.ignore[s] = linfo.ignore.get('INITIAL', '')
 
+    # Build the regexs used to skip runs of ignored characters
+    for s, ignore in linfo.ignore.items():
+        if ignore:
+            lexobj.lexstateignorere[s] = re.compile('[%s]+' % ''.join(re.escape(c) for c in ignore))
+    lexobj.lexignorere = lexobj.lexstateignorere.get('INITIAL', None)
+    lexobj.lexnewlines = newlines
+    lexobj.lexbulkerrors = bulkerrors
+    lexobj.lexlazylines = lazylines
+
     # Create global versions of the token() and input() functions
     token = lexobj.token
     input = lexobj.input
@@ -852,6 +2112,146 @@ def lex(*, module=None, object=None, debug=False,
 
     return lexobj
 
+# -----------------------------------------------------------------------------
+# TokenStream
+#
+# A stand-in for a Lexer that hands out tokens from a list built beforehand,
+# for instance by parallel_tokens().  It can be given as the lexer to parse().
+# -----------------------------------------------------------------------------
+class TokenStream(object):
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.token = functools.partial(next, iter(tokens), None)
+
+    def input(self, s):
+        pass
+
+    def __iter__(self):
+        return iter(self.token, None)
+
+# -----------------------------------------------------------------------------
+#                        === Parallel Lexing ===
+#
+# parallel_tokens() lexes a large input in worker processes.  The input is cut
+# into pieces just after newlines and each piece is lexed separately by a copy
+# of the lexer, starting in the INITIAL state.  This gives the same tokens as
+# lexing the whole input only if no token but a string literal delimited by one
+# of the quotes characters can contain a newline, and the lexer is back in the
+# INITIAL state at the end of every line.  t_eof() is called at the end of
+# each piece.  Only the type, value, lexpos and lineno of tokens are kept.
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# split_input()
+#
+# Returns the offsets at which data can be cut into at most n pieces of about
+# the same size.  Each cut is just after a newline outside of string literals.
+# String literals are found by scanning from the start of data, matching the
+# regular expression string at each quote.  By default a string runs from a
+# quote to the next one that isn't escaped, skipping backslash escapes in
+# order, and may contain newlines.  A lexer whose strings are different should
+# pass the expression of its own string rule.  Nothing after a quote where
+# string doesn't match can be cut safely, so no cuts are made after one.
+# -----------------------------------------------------------------------------
+def split_input(data, n, quotes='"', string=None):
+    size = len(data) // n
+    cuts = [0]
+    quote = re.compile('[%s]' % re.escape(quotes)) if quotes else None
+    if string is None:
+        string = '|'.join(r'%s(?:[^%s\\]|\\.)*%s' % (q, q, q) for q in map(re.escape, quotes))
+        string = re.compile(string, re.S)
+    elif isinstance(string, str):
+        string = re.compile(string)
+    pos = 0
+    while len(cuts) < n:
+        nl = data.find('\n', max(pos, cuts[-1] + size))
+        if nl < 0:
+            break
+        m = quote.search(data, pos, nl) if quote else None
+        if not m:
+            cuts.append(nl + 1)
+            pos = nl + 1
+            continue
+        m = string.match(data, m.start())
+        if not m:
+            break
+        pos = m.end()
+    return cuts
+
+# Lexer used by the worker processes
+_worker_lexer = None
+
+def _init_worker(lexer):
+    global _worker_lexer
+    _worker_lexer = lexer
+
+# Lex one piece of the input in a worker process.  The tokens are returned as
+# lists of types and values and arrays of positions and line numbers within
+# the piece.
+def _lex_piece(data):
+    lexer = _worker_lexer
+    lexer.begin('INITIAL')
+    lexer.lineno = 1
+    lexer.input(data)
+    types = []
+    values = []
+    positions = array.array('q')
+    lines = array.array('q')
+    lazylines = lexer.lexlazylines
+    for tok in lexer:
+        types.append(tok.type)
+        values.append(tok.value)
+        positions.append(tok.lexpos)
+        if not lazylines:
+            lines.append(tok.lineno)
+    return types, values, positions, lines
+
+# -----------------------------------------------------------------------------
+# parallel_tokens()
+#
+# Returns the list of tokens for data, lexed by worker processes (by default
+# one per CPU).  Inputs too small to be worth cutting into pieces of at least
+# minsize characters are lexed directly, and so are inputs that can't be cut
+# (see split_input()).  Afterwards the lexer is left at the end of data.
+# -----------------------------------------------------------------------------
+def parallel_tokens(lexer, data, workers=None, quotes='"', minsize=1 << 16, string=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n = min(workers * 4, len(data) // minsize)
+    if workers < 2 or n < 2:
+        lexer.input(data)
+        return list(lexer)
+
+    cuts = split_input(data, n, quotes, string)
+    if len(cuts) < 2:
+        lexer.input(data)
+        return list(lexer)
+    pieces = [data[start:end] for start, end in zip(cuts, cuts[1:] + [len(data)])]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                initargs=(lexer,)) as pool:
+        results = list(pool.map(_lex_piece, pieces))
+
+    # Merge the pieces, moving positions and line numbers into the whole input
+    lexer.input(data)
+    lextoken = lexer.lextoken
+    lazylines = lexer.lexlazylines
+    tokens = []
+    lineno = lexer.lineno - 1
+    prev = 0
+    for start, (types, values, positions, lines) in zip(cuts, results):
+        lineno += data.count('\n', prev, start)
+        prev = start
+        for i, pos in enumerate(positions):
+            tok = lextoken()
+            tok.type = types[i]
+            tok.value = values[i]
+            tok.lexpos = pos + start
+            if not lazylines:
+                tok.lineno = lines[i] + lineno
+            tokens.append(tok)
+    lexer.lexpos = len(data)
+    return tokens
+
 # -----------------------------------------------------------------------------
 # runmain()
 #
@@ -65,6 +65,11 @@ import re
 import types
 import sys
 import inspect
+import os
+import array
+import concurrent.futures
+
+from . import lex
 
 #-----------------------------------------------------------------------------
 #                     === User configurable parameters ===
@@ -76,6 +81,7 @@ yaccdebug   = False            # Debugging mode.  If set, yacc generates a
                                # a 'parser.out' file in the current directory
 
 debug_file  = 'parser.out'     # Default name of the debugging file
+sig_file    = 'parser.sig'     # Default name of the signature file used in optimized mode
 error_count = 3                # Number of symbols that must be shifted to leave recovery mode
 resultlimit = 40               # Size limit of results when running in debug mode.
 
@@ -168,51 +174,84 @@ class YaccSymbol:
 # a tuple of (startline,endline) representing the range of lines
 # for a symbol.  The lexspan() method returns a tuple (lexpos,endlexpos)
 # representing the range of positional information for a symbol.
+#
+# Rather than holding a copy of the right hand side, a production refers
+# directly into the parser's symbol stack.  While a rule runs, the n-1
+# symbols of the right hand side are the topmost entries of the stack and
+# the symbol that receives the result (p[0]) is held separately in sym.
 
 class YaccProduction:
     def __init__(self, s, stack=None):
-        self.slice = s
+        self.sym = s
         self.stack = stack
+        self.n = 1
         self.lexer = None
         self.parser = None
 
+    # A list of the symbols in the production.  Built on request.
+    @property
+    def slice(self):
+        if self.n == 1:
+            return [self.sym]
+        return [self.sym] + self.stack[1-self.n:]
+
+    # Return the symbol at index n, using the same indexing as slice
+    def _symbol(self, n):
+        if n < 0:
+            n += self.n
+        if n == 0:
+            return self.sym
+        if not 0 < n < self.n:
+            raise IndexError('production index out of range')
+        return self.stack[n - self.n]
+
     def __getitem__(self, n):
         if isinstance(n, slice):
             return [s.value for s in self.slice[n]]
-        elif n >= 0:
-            return self.slice[n].value
+        elif n > 0:
+            if n >= self.n:
+                raise IndexError('production index out of range')
+            return self.stack[n - self.n].value
+        elif n == 0:
+            return self.sym.value
         else:
+            # Negative indices reach the symbols below the right hand side
+            n -= self.n - 1
+            if n < -len(self.stack):
+                raise IndexError('production index out of range')
             return self.stack[n].value
 
     def __setitem__(self, n, v):
-        self.slice[n].value = v
+        self._symbol(n).value = v
 
     def __getslice__(self, i, j):
         return [s.value for s in self.slice[i:j]]
 
     def __len__(self):
-        return len(self.slice)
+        return self.n
 
     def lineno(self, n):
-        return getattr(self.slice[n], 'lineno', 0)
+        return getattr(self._symbol(n), 'lineno', 0)
 
     def set_lineno(self, n, lineno):
-        self.slice[n].lineno = lineno
+        self._symbol(n).lineno = lineno
 
     def linespan(self, n):
-        startline = getattr(self.slice[n], 'lineno', 0)
-        endline = getattr(self.slice[n], 'endlineno', startline)
+        s = self._symbol(n)
+        startline = getattr(s, 'lineno', 0)
+        endline = getattr(s, 'endlineno', startline)
         return startline, endline
 
     def lexpos(self, n):
-        return getattr(self.slice[n], 'lexpos', 0)
+        return getattr(self._symbol(n), 'lexpos', 0)
 
     def set_lexpos(self, n, lexpos):
-        self.slice[n].lexpos = lexpos
+        self._symbol(n).lexpos = lexpos
 
     def lexspan(self, n):
-        startpos = getattr(self.slice[n], 'lexpos', 0)
-        endpos = getattr(self.slice[n], 'endlexpos', startpos)
+        s = self._symbol(n)
+        startpos = getattr(s, 'lexpos', 0)
+        endpos = getattr(s, 'endlexpos', startpos)
         return startpos, endpos
 
     def error(self):
@@ -231,6 +270,7 @@ class LRParser:
         self.goto = lrtab.lr_goto
         self.errorfunc = errorf
         self.set_defaulted_states()
+        self.set_free_offsets(lrtab.grammar)
         self.errorok = True
 
     def errok(self):
@@ -244,6 +284,14 @@ class LRParser:
         self.symstack.append(sym)
         self.statestack.append(0)
 
+    # Parsers are pickled without the state of the last parse, so that they can
+    # be sent to worker processes
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('token', 'statestack', 'symstack', 'state'):
+            state.pop(name, None)
+        return state
+
     # Defaulted state support.
     # This method identifies parser states where there is only one possible reduction action.
     # For such states, the parser can make a choose to make a rule reduction without consuming
@@ -262,6 +310,60 @@ class LRParser:
     def disable_defaulted_states(self):
         self.defaulted_states = {}
 
+    # Unit chain elimination.
+    # A state whose actions all reduce the same pass-through unit rule A -> X (such as
+    # "expr : NAME" with p[0] = p[1]), whatever the lookahead, leaves the value on the
+    # stack unchanged and then goes to the state that follows A.  This method rewrites
+    # the action and goto tables so that shifting or going to X leads straight to that
+    # state, which takes these reductions out of the parse entirely.  As with defaulted
+    # states, a lookahead that the collapsed state would reject is then rejected in the
+    # state that follows.  The symbol left on the stack keeps its original type X.
+    def collapse_unit_chains(self):
+        unit = {}
+        for state, actions in self.action.items():
+            rules = set(actions.values())
+            if len(rules) != 1:
+                continue
+            t = rules.pop()
+            if t is not None and t < 0:
+                p = self.productions[-t]
+                if p.len == 1 and p.passthrough:
+                    unit[state] = p.name
+
+        def follow(state, target):
+            seen = set()
+            while target in unit and target not in seen:
+                seen.add(target)
+                target = self.goto[state][unit[target]]
+            return target
+
+        for state, actions in self.action.items():
+            for a, t in actions.items():
+                if t is not None and t > 0 and t in unit:
+                    actions[a] = follow(state, t)
+
+        for state, gotos in self.goto.items():
+            for n, g in gotos.items():
+                if g in unit:
+                    gotos[n] = follow(state, g)
+
+        # The stack entries standing in for the collapsed nonterminals may now be
+        # tokens, which must never be put on the free list
+        collapsed = set(unit.values())
+        for p in self.productions:
+            if p:
+                p.free = tuple(i for i in p.free if p.prod[i + p.len] not in collapsed)
+
+    # Symbol reuse support.
+    # For each production, this records the stack offsets of the nonterminal symbols on
+    # its right hand side.  Those symbols were created by the parser during earlier
+    # reductions and are no longer referenced once the production has been reduced, so
+    # parse() puts them back on a free list and reuses them for later results.
+    def set_free_offsets(self, grammar):
+        for p in self.productions:
+            if p:
+                p.free = tuple(n - p.len for n, s in enumerate(p.prod) if s in grammar.Nonterminals)
+
     # parse().
     #
     # This is the core parsing engine.  To operate, it requires a lexer object.
@@ -282,6 +384,7 @@ class LRParser:
         prod    = self.productions               # Local reference to production list (to avoid lookup on self.)
         defaulted_states = self.defaulted_states # Local reference to defaulted states
         pslice  = YaccProduction(None)           # Production object passed to grammar rules
+        symfree = []                             # Free list of symbols available for reuse
         errorcount = 0                           # Used during error recovery
 
         if debug:
@@ -289,7 +392,6 @@ class LRParser:
 
         # If no lexer was given, we will try to use the lex module
         if not lexer:
-            from . import lex
             lexer = lex.lexer
 
         # Set up the lexer and parser objects on pslice
@@ -369,8 +471,14 @@ class LRParser:
                     pname = p.name
                     plen  = p.len
 
-                    # Get production function
-                    sym = YaccSymbol()
+                    # Get a symbol for the result, reusing a free one if possible.
+                    # A reused symbol is cleared, so that it doesn't keep the
+                    # positions of an earlier result.
+                    if symfree:
+                        sym = symfree.pop()
+                        sym.__dict__.clear()
+                    else:
+                        sym = YaccSymbol()
                     sym.type = pname       # Production name
                     sym.value = None
 
@@ -384,14 +492,11 @@ class LRParser:
                                        goto[statestack[-1]][pname])
 
                     if plen:
-                        targ = symstack[-plen-1:]
-                        targ[0] = sym
-
                         if tracking:
-                            t1 = targ[1]
+                            t1 = symstack[-plen]
                             sym.lineno = t1.lineno
                             sym.lexpos = t1.lexpos
-                            t1 = targ[-1]
+                            t1 = symstack[-1]
                             sym.endlineno = getattr(t1, 'endlineno', t1.lineno)
                             sym.endlexpos = getattr(t1, 'endlexpos', t1.lexpos)
 
@@ -400,23 +505,41 @@ class LRParser:
                         # below as a performance optimization.  Make sure
                         # changes get made in both locations.
 
-                        pslice.slice = targ
+                        # The production refers to the right hand side in place
+                        pslice.sym = sym
+                        pslice.n = plen + 1
 
                         try:
                             # Call the grammar rule with our special slice object
-                            del symstack[-plen:]
+                            # or, for @VALUES rules, with the right hand side values
                             self.state = state
-                            p.callable(pslice)
-                            del statestack[-plen:]
+                            if p.passthrough:
+                                sym.value = symstack[-plen].value
+                            elif p.values is None:
+                                p.callable(pslice)
+                            elif p.values:
+                                sym.value = p.callable(pslice, *[_v.value for _v in symstack[-plen:]])
+                            elif plen == 1:
+                                sym.value = p.callable(symstack[-1].value)
+                            elif plen == 2:
+                                sym.value = p.callable(symstack[-2].value, symstack[-1].value)
+                            elif plen == 3:
+                                sym.value = p.callable(symstack[-3].value, symstack[-2].value, symstack[-1].value)
+                            else:
+                                sym.value = p.callable(*[_v.value for _v in symstack[-plen:]])
                             if debug:
                                 debug.info('Result : %s', format_result(pslice[0]))
+                            for i in p.free:
+                                symfree.append(symstack[i])
+                            del symstack[-plen:]
+                            del statestack[-plen:]
                             symstack.append(sym)
                             state = goto[statestack[-1]][pname]
                             statestack.append(state)
                         except SyntaxError:
                             # If an error was set. Enter error recovery state
                             lookaheadstack.append(lookahead)    # Save the current lookahead token
-                            symstack.extend(targ[1:-1])         # Put the production slice back on the stack
+                            symstack.pop()                      # Leave the rest of the production slice on the stack
                             statestack.pop()                    # Pop back one state (before the reduce)
                             state = statestack[-1]
                             sym.type = 'error'
@@ -430,22 +553,27 @@ class LRParser:
                     else:
 
                         if tracking:
-                            sym.lineno = lexer.lineno
-                            sym.lexpos = lexer.lexpos
-
-                        targ = [sym]
+                            sym.lineno = sym.endlineno = lexer.lineno
+                            sym.lexpos = sym.endlexpos = lexer.lexpos
 
                         # !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!
                         # The code enclosed in this section is duplicated
                         # above as a performance optimization.  Make sure
                         # changes get made in both locations.
 
-                        pslice.slice = targ
+                        pslice.sym = sym
+                        pslice.n = 1
 
                         try:
                             # Call the grammar rule with our special slice object
+                            # or, for @VALUES rules, with no values at all
                             self.state = state
-                            p.callable(pslice)
+                            if p.values is None:
+                                p.callable(pslice)
+                            elif p.values:
+                                sym.value = p.callable(pslice)
+                            else:
+                                sym.value = p.callable()
                             if debug:
                                 debug.info('Result : %s', format_result(pslice[0]))
                             symstack.append(sym)
@@ -607,6 +735,8 @@ _is_identifier = re.compile(r'^[a-zA-Z0-9_-]+$')
 #       func     - Function that executes on reduce
 #       file     - File where production function is defined
 #       lineno   - Line number where production function is defined
+#       values   - Calling convention of the function (see @VALUES)
+#       passthrough - True if the function only passes on the value of the first symbol
 #
 # The following attributes are defined or optional.
 #
@@ -622,6 +752,8 @@ class Production(object):
         self.number   = number
         self.func     = func
         self.callable = None
+        self.values   = None
+        self.passthrough = False
         self.file     = file
         self.line     = line
         self.prec     = precedence
@@ -681,6 +813,42 @@ class Production(object):
     def bind(self, pdict):
         if self.func:
             self.callable = pdict[self.func]
+            self.values = getattr(self.callable, 'values', None)
+            self.passthrough = self.len > 0 and is_passthrough(self.callable)
+
+# -----------------------------------------------------------------------------
+# is_passthrough()
+#
+# Returns True if a grammar rule function does nothing but pass on the value of
+# the first symbol on the right hand side.  Such functions are either marked with
+# @PASSTHROUGH or have the same code as one of the reference rules below.  The
+# parser performs these reductions without calling the function at all.
+# -----------------------------------------------------------------------------
+
+def _passthrough_rule(p):
+    'rule : symbol'
+    p[0] = p[1]
+
+def _passthrough_values(value):
+    'rule : symbol'
+    return value
+
+def is_passthrough(func):
+    if getattr(func, 'passthrough', False):
+        return True
+    values = getattr(func, 'values', None)
+    if values is None:
+        ref = _passthrough_rule.__code__
+    elif not values:
+        ref = _passthrough_values.__code__
+    else:
+        return False
+    code = getattr(func, '__code__', None)
+    if code is None or isinstance(func, types.MethodType):
+        return False
+    return (code.co_code == ref.co_code and code.co_argcount == ref.co_argcount and
+            code.co_flags == ref.co_flags and code.co_names == ref.co_names and
+            code.co_consts[1:] == ref.co_consts[1:])
 
 # -----------------------------------------------------------------------------
 # class LRItem
@@ -2023,22 +2191,37 @@ class ParserReflect(object):
         self.validate_modules()
         return self.error
 
-    # Compute a signature over the grammar
+    # Compute a signature over the grammar.  Besides the rules themselves, it
+    # covers the function each rule is in, its arguments and how it is called,
+    # since validate_pfunctions() checks those too.
     def signature(self):
-        parts = []
-        try:
-            if self.start:
-                parts.append(self.start)
-            if self.prec:
-                parts.append(''.join([''.join(p) for p in self.prec]))
-            if self.tokens:
-                parts.append(' '.join(self.tokens))
-            for f in self.pfuncs:
-                if f[3]:
-                    parts.append(f[3])
-        except (TypeError, ValueError):
-            pass
-        return ''.join(parts)
+        rules = []
+        for line, module, name, doc in self.pfuncs:
+            func = self.pdict[name]
+            code = getattr(func, '__code__', None)
+            args = (code.co_argcount, bool(code.co_flags & inspect.CO_VARARGS)) if code else None
+            rules.append((name, doc, isinstance(func, types.MethodType), args,
+                          getattr(func, 'values', None), getattr(func, 'passthrough', False)))
+        return repr((self.start, self.prec, self.tokens, rules))
+
+    # Collect the precedence list and grammar rules without any validation.  This
+    # is used in optimized mode for grammars whose signature was recorded by an
+    # earlier build that passed all of the checks.
+    def get_grammar(self):
+        preclist = []
+        for level, p in enumerate(self.prec or ()):
+            for term in p[1:]:
+                preclist.append((term, p[0], level+1))
+        self.preclist = preclist
+
+        grammar = []
+        for line, module, name, doc in self.pfuncs:
+            if not doc:
+                continue
+            file = self.pdict[name].__code__.co_filename
+            for g in parse_grammar(doc, file, line):
+                grammar.append((name, g))
+        self.grammar = grammar
 
     # -----------------------------------------------------------------------------
     # validate_modules()
@@ -2217,10 +2400,11 @@ class ParserReflect(object):
                 reqargs = 2
             else:
                 reqargs = 1
-            if func.__code__.co_argcount > reqargs:
+            values = getattr(func, 'values', None)
+            if values is None and func.__code__.co_argcount > reqargs:
                 self.log.error('%s:%d: Rule %r has too many arguments', file, line, func.__name__)
                 self.error = True
-            elif func.__code__.co_argcount < reqargs:
+            elif values is None and func.__code__.co_argcount < reqargs:
                 self.log.error('%s:%d: Rule %r requires an argument', file, line, func.__name__)
                 self.error = True
             elif not func.__doc__:
@@ -2234,6 +2418,9 @@ class ParserReflect(object):
                 except SyntaxError as e:
                     self.log.error(str(e))
                     self.error = True
+                else:
+                    if values is not None:
+                        self.validate_values(func, values, reqargs, parsed_g)
 
                 # Looks like a valid grammar rule
                 # Mark the file in which defined.
@@ -2262,15 +2449,32 @@ class ParserReflect(object):
 
         self.grammar = grammar
 
+    # Make sure that a @VALUES rule accepts as many arguments as there are symbols
+    # on the right hand side of each of its productions
+    def validate_values(self, func, values, reqargs, parsed_g):
+        code = func.__code__
+        if code.co_flags & inspect.CO_VARARGS:
+            return
+        nargs = code.co_argcount - (reqargs - 1) - (1 if values else 0)
+        for file, line, prodname, syms in parsed_g:
+            nsyms = len(syms) - 2 if '%prec' in syms else len(syms)
+            if nsyms != nargs:
+                self.log.error('%s:%d: Rule %r takes %d values, but the production has %d symbols',
+                               file, line, func.__name__, nargs, nsyms)
+                self.error = True
+
 # -----------------------------------------------------------------------------
 # yacc(module)
 #
-# Build a parser
+# Build a parser.  If optimize is set, a grammar whose signature is found in
+# sigfile is trusted as-is: duplicate rule scanning of the source modules,
+# unused symbol reports and the recursion checks are all skipped.  sigfile
+# defaults to parser.sig in the directory of the grammar module.
 # -----------------------------------------------------------------------------
 
 def yacc(*, debug=yaccdebug, module=None, start=None,
          check_recursion=True, optimize=False, debugfile=debug_file,
-         debuglog=None, errorlog=None):
+         debuglog=None, errorlog=None, sigfile=None):
 
     # Reference to the parsing method of the last built parser
     global parse
@@ -2317,8 +2521,19 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
 
     errors = False
 
+    # In optimized mode, look for a previously validated signature
+    digest = None
+    validated = False
+    if optimize:
+        if sigfile is None:
+            sigfile = lex.signature_file(pdict, sig_file)
+        digest = lex.signature_digest(pinfo.signature())
+        validated = digest in lex.read_signatures(sigfile)
+
     # Validate the parser information
-    if pinfo.validate_all():
+    if validated:
+        pinfo.get_grammar()
+    elif pinfo.validate_all():
         raise YaccError('Unable to build parser')
 
     if not pinfo.error_func:
@@ -2356,13 +2571,21 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
     if errors:
         raise YaccError('Unable to build parser')
 
-    # Verify the grammar structure
-    undefined_symbols = grammar.undefined_symbols()
+    # Verify the grammar structure.  A grammar that was already validated in
+    # optimized mode skips all of the checks and reports below.
+    if validated:
+        check_recursion = False
+        undefined_symbols = unused_terminals = unused_rules = unused_prec = []
+    else:
+        undefined_symbols = grammar.undefined_symbols()
+        unused_terminals = grammar.unused_terminals()
+        unused_rules = grammar.unused_rules()
+        unused_prec = grammar.unused_precedence()
+
     for sym, prod in undefined_symbols:
         errorlog.error('%s:%d: Symbol %r used, but not defined as a token or a rule', prod.file, prod.line, sym)
         errors = True
 
-    unused_terminals = grammar.unused_terminals()
     if unused_terminals:
         debuglog.info('')
         debuglog.info('Unused terminals:')
@@ -2379,8 +2602,7 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
         for n, p in enumerate(grammar.Productions):
             debuglog.info('Rule %-5d %s', n, p)
 
-    # Find unused non-terminals
-    unused_rules = grammar.unused_rules()
+    # Report unused non-terminals
     for prod in unused_rules:
         errorlog.warning('%s:%d: Rule %r defined, but not used', prod.file, prod.line, prod.name)
 
@@ -2422,7 +2644,6 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
             errorlog.error('Infinite recursion detected for symbol %r', inf)
             errors = True
 
-    unused_prec = grammar.unused_precedence()
     for term, assoc in unused_prec:
         errorlog.error('Precedence rule %r defined for unknown symbol %r', assoc, term)
         errors = True
@@ -2474,9 +2695,116 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
                 errorlog.warning('Rule (%s) is never reduced', rejected)
                 warned_never.append(rejected)
 
+    # Record the signature of a newly validated grammar
+    if optimize and not validated:
+        lex.write_signature(sigfile, digest, errorlog)
+
     # Build the parser
     lr.bind_callables(pinfo.pdict)
     parser = LRParser(lr, pinfo.error_func)
 
     parse = parser.parse
     return parser
+
+# -----------------------------------------------------------------------------
+#                        === Parallel Parsing ===
+#
+# parallel_parse() parses pieces of a token stream in worker processes, each
+# with a copy of the parser and its tables.  Every piece must be a complete
+# sentence of the grammar on its own, for example a run of whole top-level
+# statements.  The caller decides where the token stream can be cut and how
+# the results of the pieces are put together.
+# -----------------------------------------------------------------------------
+
+# Raised in the workers to give up on a piece with a syntax error
+class _ParseAbort(Exception):
+    pass
+
+def _abort_parse(tok):
+    raise _ParseAbort()
+
+# Parser used by the worker processes
+_worker_parser = None
+
+def _init_worker(parser):
+    global _worker_parser
+    parser.errorfunc = _abort_parse
+    _worker_parser = parser
+
+# Parse one piece of tokens, given as lists of types and values and an array of
+# positions, in a worker process.  Returns a tuple (ok, result) where ok is
+# False if the piece has a syntax error.
+def _parse_piece(piece):
+    from .lex import LexToken, TokenStream
+    tokens = []
+    for toktype, value, lexpos in zip(*piece):
+        tok = LexToken()
+        tok.type = toktype
+        tok.value = value
+        tok.lexpos = lexpos
+        tok.lineno = 0
+        tokens.append(tok)
+    try:
+        return True, _worker_parser.parse(lexer=TokenStream(tokens))
+    except _ParseAbort:
+        return False, None
+
+# -----------------------------------------------------------------------------
+# parallel_parse()
+#
+# Parses a list of pieces, each a list of tokens, with worker processes (by
+# default one per CPU).  Returns the list of the results of the pieces in order,
+# or None if any piece has a syntax error.  In that case the error function of
+# the parser is not called, so that the input can be parsed again as a whole
+# to report errors.  Only the type, value and lexpos of tokens reach the
+# workers.
+# -----------------------------------------------------------------------------
+def parallel_parse(parser, pieces, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    compact = [([t.type for t in p], [t.value for t in p], array.array('q', [t.lexpos for t in p]))
+               for p in pieces]
+    with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                initargs=(parser,)) as pool:
+        results = list(pool.map(_parse_piece, compact))
+    if not all(ok for ok, result in results):
+        return None
+    return [result for ok, result in results]
+
+# -----------------------------------------------------------------------------
+# @VALUES
+#
+# This decorator selects a faster calling convention for a grammar rule.  Rather
+# than a YaccProduction object, the rule receives the values of the symbols on the
+# right hand side as positional arguments, and whatever it returns becomes the
+# value of the rule.  For example:
+#
+#     @VALUES
+#     def p_expr_plus(left, op, right):
+#         'expr : expr PLUS expr'
+#         return left + right
+#
+# Use @VALUES(production=True) to also receive the YaccProduction object as the
+# first argument, for rules that need lineno(), lexpos() and friends.
+# -----------------------------------------------------------------------------
+
+def VALUES(f=None, *, production=False):
+    def set_values(f):
+        f.values = production
+        return f
+    if f is None:
+        return set_values
+    return set_values(f)
+
+# -----------------------------------------------------------------------------
+# @PASSTHROUGH
+#
+# This decorator marks a grammar rule whose value is always the value of the first
+# symbol on the right hand side.  The parser then performs the reduction without
+# calling the function.  Rules written as p[0] = p[1] (or, with @VALUES, as a
+# function returning its only argument) are recognized without the decorator.
+# -----------------------------------------------------------------------------
+
+def PASSTHROUGH(f):
+    f.passthrough = True
+    return f
@@ -0,0 +1,275 @@
+# -----------------------------------------------------------------------------
+# pycode.py
+#
+# Runs the programs parsed by compiler.py as Python code.  The statements are
+# translated into the body of a Python function, with the variables of the
+# program as its local variables, and compiled with compile().  The code
+# objects are cached by a hash of the source they were parsed from, in memory
+# and, if load() is given a directory, on disk, so that a program that hasn't
+# changed isn't parsed or compiled again by later runs either.
+#
+# For example, the function generated for
+#
+#     int a = 5;
+#     while (a > 0) { print(a); a = a - 1; }
+#
+# is
+#
+#     def program(show, counting):
+#         _a = 5
+#         while _a > 0:
+#             show(_a)
+#             _a = _a - 1
+#
+# Variables get a '_' in front so that they can't clash with Python keywords
+# or with the names used by the generated code.
+# -----------------------------------------------------------------------------
+
+import ast
+import hashlib
+import marshal
+import os
+import sys
+import tac
+
+# Number of code objects kept in the cache
+cache_size = 64
+
+binary_ops = {
+    '+': ast.Add,
+    '-': ast.Sub,
+    '*': ast.Mult,
+    '/': ast.Div,
+    '^': ast.Pow,
+    }
+
+compare_ops = {
+    '==': ast.Eq,
+    '!=': ast.NotEq,
+    '>=': ast.GtE,
+    '<=': ast.LtE,
+    '>':  ast.Gt,
+    '<':  ast.Lt,
+    }
+
+bool_ops = {
+    'and': ast.And,
+    'or':  ast.Or,
+    }
+
+# Return the names of the variables declared or assigned by statements
+def assigned(statements):
+    names = set()
+    for node in statements or ():
+        kind = node[0]
+        if kind in ('declare', 'declare assign'):
+            names.add(node[2])
+        elif kind == 'assign':
+            names.add(node[1])
+        elif kind == 'condition':
+            _, ifpart, elifs, elsepart = node
+            for part in (ifpart,) + tuple(elifs or ()):
+                names |= assigned(part[2])
+            if elsepart:
+                names |= assigned(elsepart[1])
+        elif kind == 'for':
+            names |= assigned((node[1], node[3]))
+            names |= assigned(node[4])
+        elif kind == 'while':
+            names |= assigned(node[2])
+    return names
+
+# -----------------------------------------------------------------------------
+# Translator
+#
+# Translates statements from the parser into a Python ast.Module defining the
+# function program(show, counting).  show(value) prints a value and
+# counting(start, stop) iterates over the values of a counted for loop.
+# -----------------------------------------------------------------------------
+class Translator(object):
+    def __init__(self):
+        self.stops = 0
+
+    def module(self, statements):
+        tree = ast.parse('def program(show, counting):\n    pass')
+        tree.body[0].body = self.statements(statements)
+        return ast.fix_missing_locations(tree)
+
+    def statements(self, nodes):
+        body = []
+        for node in nodes or ():
+            body.extend(self.statement(node))
+        return body or [ast.Pass()]
+
+    # Return the list of Python statements for a statement
+    def statement(self, node):
+        kind = node[0]
+        if kind == 'declare':
+            return [self.assign(node[2], ast.Constant(tac.defaults[node[1]]))]
+        if kind == 'declare assign':
+            return [self.assign(node[2], self.expression(node[3]))]
+        if kind == 'assign':
+            return [self.assign(node[1], self.expression(node[2]))]
+        if kind == 'print':
+            call = ast.Call(ast.Name('show', ast.Load()), [self.expression(node[1])], [])
+            return [ast.Expr(call)]
+        if kind == 'condition':
+            _, ifpart, elifs, elsepart = node
+            orelse = self.statements(elsepart[1]) if elsepart else []
+            for _, cond, body in reversed((ifpart,) + tuple(elifs or ())):
+                orelse = [ast.If(self.expression(cond), self.statements(body), orelse)]
+            return orelse
+        if kind == 'for':
+            return self.counted(node) or self.loop(node[2], node[4], init=node[1], step=node[3])
+        if kind == 'while':
+            return self.loop(node[1], node[2])
+        raise ValueError('Unknown statement %r' % (node,))
+
+    def assign(self, name, value):
+        return ast.Assign([ast.Name('_' + name, ast.Store())], value)
+
+    def loop(self, cond, body, init=None, step=None):
+        body = self.statements(body)
+        if step:
+            body = [ins for ins in body if not isinstance(ins, ast.Pass)] + self.statement(step)
+        loop = ast.While(self.expression(cond), body, [])
+        return (self.statement(init) if init else []) + [loop]
+
+    # for loops counting a variable up by one to a bound that doesn't change,
+    #
+    #     for(int i = start; i < stop; i = i + 1){ ... }
+    #
+    # are run as Python for loops over counting(_i, stop), which is a range
+    # when both bounds are integers.  Afterwards i is set to the value that
+    # ended the loop.  Returns None for other loops.
+    def counted(self, node):
+        _, init, cond, step, body = node
+        name = init[2]
+        if not (isinstance(cond, tuple) and cond[0] == 'operation' and cond[1] == name and cond[2] == '<'):
+            return None
+        by = step[2]
+        if step[1] != name or not (isinstance(by, tuple) and by[0] == 'operation' and by[2] == '+'):
+            return None
+        if not (by[1] == name and type(by[3]) is int and by[3] == 1 or
+                by[3] == name and type(by[1]) is int and by[1] == 1):
+            return None
+        stop = cond[3]
+        changed = assigned(body)
+        if name in changed or not (isinstance(stop, (int, float)) or isinstance(stop, str) and stop not in changed):
+            return None
+
+        result = self.statement(init)
+        if isinstance(stop, str):
+            self.stops += 1
+            stop_name = 'stop%d' % self.stops
+            result.append(ast.Assign([ast.Name(stop_name, ast.Store())], self.expression(stop)))
+            stop = ast.Name(stop_name, ast.Load())
+        else:
+            stop = ast.Constant(stop)
+        var = '_' + name
+        counter = ast.Call(ast.Name('counting', ast.Load()), [ast.Name(var, ast.Load()), stop], [])
+        result.append(ast.For(ast.Name(var, ast.Store()), counter, self.statements(body), []))
+        # if _i < stop: _i = _i + 1
+        test = ast.Compare(ast.Name(var, ast.Load()), [ast.Lt()], [stop])
+        increment = ast.BinOp(ast.Name(var, ast.Load()), ast.Add(), ast.Constant(1))
+        result.append(ast.If(test, [self.assign(name, increment)], []))
+        return result
+
+    def expression(self, node):
+        if isinstance(node, tuple):
+            kind = node[0]
+            if kind == 'string':
+                return ast.Constant(node[1])
+            if kind == 'neg':
+                return ast.UnaryOp(ast.USub(), self.expression(node[1]))
+            if kind == 'operation':
+                _, left, op, right = node
+                left = self.expression(left)
+                right = self.expression(right)
+                if op in binary_ops:
+                    return ast.BinOp(left, binary_ops[op](), right)
+                if op in compare_ops:
+                    return ast.Compare(left, [compare_ops[op]()], [right])
+                return ast.BoolOp(bool_ops[op](), [left, right])
+            raise ValueError('Unknown expression %r' % (node,))
+        if isinstance(node, str):
+            return ast.Name('_' + node, ast.Load())
+        return ast.Constant(node)
+
+# Iterate over start, start + 1, ... while less than stop
+def counting(start, stop):
+    if type(start) is int and type(stop) is int:
+        return range(start, stop)
+    return _counting(start, stop)
+
+def _counting(i, stop):
+    while i < stop:
+        yield i
+        i = i + 1
+
+# Return the code object of a module defining program() for statements
+def compile_statements(statements):
+    return compile(Translator().module(statements), '<program>', 'exec')
+
+_cache = {}
+
+# Return a hash of the source of a program.  It also covers the version of
+# Python, whose code objects only it can load, and the contents of the
+# files in depends, which make the code from the source.
+def source_hash(source, depends=()):
+    h = hashlib.sha256(sys.implementation.cache_tag.encode('utf-8'))
+    for filename in depends:
+        with open(filename, 'rb') as f:
+            h.update(f.read())
+    h.update(source.encode('utf-8'))
+    return h.hexdigest()
+
+# Return the code object cached on disk under key, or None
+def read_code(cache_dir, key):
+    try:
+        with open(os.path.join(cache_dir, key + '.code'), 'rb') as f:
+            return marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+
+# Cache a code object on disk.  The file is written under another name and
+# then renamed, so that a run never reads half of it.  Failing to write it
+# only means the program is compiled again next time.
+def write_code(cache_dir, key, code):
+    filename = os.path.join(cache_dir, key + '.code')
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(filename + '.tmp', 'wb') as f:
+            marshal.dump(code, f)
+        os.replace(filename + '.tmp', filename)
+    except OSError:
+        pass
+
+# Return the code object for a program.  parse(source) is only called to get
+# the statements of the program if its code isn't in the cache, and may
+# return None if the program has errors, in which case None is returned.
+# If cache_dir is given, code objects are also kept there between runs, and
+# depends names the files that make the code, as for source_hash().
+def load(source, parse, cache_dir=None, depends=()):
+    key = source_hash(source, depends)
+    code = _cache.get(key)
+    if code is None and cache_dir:
+        code = read_code(cache_dir, key)
+    if code is None:
+        statements = parse(source)
+        if statements is None:
+            return None
+        code = compile_statements(statements)
+        if cache_dir:
+            write_code(cache_dir, key, code)
+    if key not in _cache:
+        if len(_cache) >= cache_size:
+            del _cache[next(iter(_cache))]
+        _cache[key] = code
+    return code
+
+# Run the code object of a program
+def run(code, show=tac.show):
+    namespace = {}
+    exec(code, namespace)
+    namespace['program'](show, counting)
@@ -0,0 +1,370 @@
+# -----------------------------------------------------------------------------
+# ssa.py
+#
+# Static single assignment form of the control-flow graphs in ir.py, and the
+# optimizations done in it: sparse conditional constant propagation and dead
+# code elimination.
+#
+# In SSA form every assignment to a variable defines a new Version of it, and
+# uses refer to the version that reaches them.  Where different versions meet,
+# a phi function at the start of the block picks the one coming from the
+# predecessor that was taken.  Version 0 of a variable is the value it has on
+# entry to the code.  Temporaries are already assigned only once and are left
+# as they are.
+#
+# The optimizations never move code and only replace uses of variables by
+# constants, so no two versions of the same variable are ever live at the
+# same time.  Converting back out of SSA form is then just a matter of
+# dropping the phi functions and the version numbers.
+# -----------------------------------------------------------------------------
+
+from collections import namedtuple
+import ir
+import loops
+import tac
+
+Version = namedtuple('Version', ['name', 'number'])
+
+# Value of a name in constant propagation that isn't known to be defined yet,
+# and of one that isn't constant.  Otherwise the value is a tac.Const.
+undefined = None
+varying = 'varying'
+
+# Limits on the operations that are done at compile time, so that constant
+# folding doesn't build huge numbers or strings.  Results are estimated
+# before they are computed, so chains of operations are limited too.
+fold_max_exponent = 1024
+fold_max_repeat = 4096
+fold_max_bits = 1 << 16
+fold_max_length = 1 << 16
+
+# Return True if two constants have the same value and type
+def same(a, b):
+    return type(a.value) is type(b.value) and a.value == b.value
+
+# Combine the values of a name coming from two places
+def meet(a, b):
+    if a is undefined:
+        return b
+    if b is undefined:
+        return a
+    if a is varying or b is varying or not same(a, b):
+        return varying
+    return a
+
+# Return an upper bound on the size of the result of an operation, in bits
+# for ints and characters for strings, or 0 if it can't be large
+def result_size(op, a, b):
+    if op == '^' and isinstance(a, int) and isinstance(b, int) and b > 0:
+        return a.bit_length() * b
+    if op == '*':
+        if isinstance(a, int) and isinstance(b, int):
+            return a.bit_length() + b.bit_length()
+        if isinstance(a, str) and isinstance(b, int):
+            return len(a) * b
+        if isinstance(a, int) and isinstance(b, str):
+            return a * len(b)
+    if op == '+' and isinstance(a, str) and isinstance(b, str):
+        return len(a) + len(b)
+    return 0
+
+# Return the value of an operation on constants, or varying if it can't be
+# computed at compile time
+def fold(op, a, b=None):
+    a = a.value
+    b = b.value if b is not None else None
+    if op == '^' and isinstance(b, int) and abs(b) > fold_max_exponent:
+        return varying
+    if op == '*' and isinstance(a, str) != isinstance(b, str):
+        count = b if isinstance(a, str) else a
+        if isinstance(count, int) and count > fold_max_repeat:
+            return varying
+    size = result_size(op, a, b)
+    if size > (fold_max_length if isinstance(a, str) or isinstance(b, str) else fold_max_bits):
+        return varying
+    try:
+        return tac.Const(tac.evaluate(op, a, b))
+    except (ArithmeticError, MemoryError, TypeError, ValueError):
+        return varying
+
+# Return True if a name has an SSA definition
+def _is_name(x):
+    return isinstance(x, (Version, tac.Temp))
+
+# -----------------------------------------------------------------------------
+# SSA
+#
+# A control-flow graph in SSA form.  blocks holds the instructions of every
+# block and phis[b] the phi functions of block b, as [dest, args] lists with
+# one argument for each predecessor of b, in the order of
+# cfg.predecessors(b).  exits[b] holds the versions of the variables at the
+# end of block b if the code ends there: their values are seen by the code
+# compiled after it.
+# -----------------------------------------------------------------------------
+class SSA(object):
+    def __init__(self, cfg):
+        cfg.remove_unreachable()
+        cfg.split_entry()
+        self.cfg = cfg
+        self.blocks = cfg.blocks()
+        self.phis = [[] for b in range(cfg.nblocks)]
+        self.exits = {}
+        self.block_of = {label: b for b, label in enumerate(cfg.labels) if label is not None}
+        self._place_phis()
+        self._rename()
+
+    # Put a phi function for each variable in the iterated dominance frontier
+    # of the blocks that assign it
+    def _place_phis(self):
+        defs = {}
+        for b, block in enumerate(self.blocks):
+            for op, dest, a, _ in block:
+                if op in ('dec', ':=') and isinstance(dest, str):
+                    defs.setdefault(dest, set()).add(b)
+        self.variables = sorted(defs)
+
+        frontier = self.cfg.frontiers()
+        for name in self.variables:
+            placed = set()
+            work = list(defs[name])
+            while work:
+                for f in frontier[work.pop()]:
+                    if f not in placed:
+                        placed.add(f)
+                        self.phis[f].append([name, [name] * len(self.cfg.predecessors(f))])
+                        if f not in defs[name]:
+                            work.append(f)
+
+    # Give every definition a new version, walking the dominator tree so that
+    # the version reaching each use is on top of the stack of its variable
+    def _rename(self):
+        cfg = self.cfg
+        count = {}
+        stacks = {}
+
+        def current(x):
+            if isinstance(x, str):
+                stack = stacks.get(x)
+                return stack[-1] if stack else Version(x, 0)
+            return x
+
+        def new_version(name, pushed):
+            count[name] = count.get(name, 0) + 1
+            version = Version(name, count[name])
+            stacks.setdefault(name, []).append(version)
+            pushed.append(name)
+            return version
+
+        work = [(0, None)] if cfg.nblocks else []
+        while work:
+            b, pushed = work.pop()
+            if pushed is not None:
+                # Leaving the subtree of b
+                for name in pushed:
+                    stacks[name].pop()
+                continue
+            pushed = []
+            for phi in self.phis[b]:
+                phi[0] = new_version(phi[0], pushed)
+            block = self.blocks[b]
+            for i, ins in enumerate(block):
+                ins = tac.map_operands(ins, current)
+                op, dest, a, c = ins
+                if op in ('dec', ':=') and isinstance(dest, str):
+                    ins = (op, new_version(dest, pushed), a, c)
+                block[i] = ins
+            succ = cfg.successors(b)
+            for s in succ:
+                j = list(cfg.predecessors(s)).index(b)
+                for phi in self.phis[s]:
+                    phi[1][j] = current(phi[1][j])
+            if not succ:
+                self.exits[b] = [current(name) for name in self.variables]
+            work.append((b, pushed))
+            work.extend((child, None) for child in reversed(cfg.dominated(b)))
+
+    # Return the block a jump goes to if taken
+    def _target(self, ins):
+        return self.block_of[tac.jump_target(ins)]
+
+    # -------------------------------------------------------------------------
+    # Sparse conditional constant propagation (Wegman and Zadeck).  Blocks are
+    # only looked at once an edge into them is known to be taken, and names
+    # start out undefined, so values flowing around loops are assumed constant
+    # until shown otherwise.  Sets self.values to the value of every name and
+    # self.executable to the blocks that can run.
+    # -------------------------------------------------------------------------
+    def propagate_constants(self):
+        cfg = self.cfg
+        values = {}
+        uses = {}
+        for b, block in enumerate(self.blocks):
+            for k, (dest, args) in enumerate(self.phis[b]):
+                for x in args:
+                    uses.setdefault(x, []).append((b, -1 - k))
+            for i, ins in enumerate(block):
+                for x in tac.operands(ins):
+                    if _is_name(x):
+                        uses.setdefault(x, []).append((b, i))
+
+        edges = set()
+        executable = bytearray(cfg.nblocks)
+        flow = [(-1, 0)] if cfg.nblocks else []
+        names = []
+
+        def value(x):
+            if isinstance(x, tac.Const):
+                return x
+            if isinstance(x, Version) and x.number == 0:
+                return varying
+            return values.get(x, undefined)
+
+        # Values only ever go from undefined to a constant to varying
+        def set_value(name, new):
+            old = values.get(name, undefined)
+            if old is varying or new is undefined:
+                return
+            if old is not undefined and new is not varying:
+                if same(old, new):
+                    return
+                new = varying
+            values[name] = new
+            names.append(name)
+
+        def visit_phi(b, k):
+            dest, args = self.phis[b][k]
+            new = undefined
+            for p, x in zip(cfg.predecessors(b), args):
+                if (p, b) in edges:
+                    new = meet(new, value(x))
+            set_value(dest, new)
+
+        def visit(b, i):
+            op, dest, a, c = self.blocks[b][i]
+            if op == ':=':
+                set_value(dest, value(a))
+            elif op == 'dec':
+                set_value(dest, varying)
+            elif op == 'neg' or op in tac.binary_ops:
+                args = [value(a)] if op == 'neg' else [value(a), value(c)]
+                if varying in args:
+                    set_value(dest, varying)
+                elif undefined not in args:
+                    set_value(dest, fold(op, *args))
+            elif op in ('iffalse', 'iftrue'):
+                cond = value(a)
+                if cond is varying or cond is not undefined and (op == 'iftrue') == bool(cond.value):
+                    flow.append((b, self._target(self.blocks[b][i])))
+                if cond is varying or cond is not undefined and (op == 'iftrue') != bool(cond.value):
+                    flow.append((b, b + 1))
+            elif op == 'goto':
+                flow.append((b, self._target(self.blocks[b][i])))
+
+        while flow or names:
+            if flow:
+                p, b = flow.pop()
+                if (p, b) in edges:
+                    continue
+                edges.add((p, b))
+                for k in range(len(self.phis[b])):
+                    visit_phi(b, k)
+                if not executable[b]:
+                    executable[b] = 1
+                    block = self.blocks[b]
+                    for i in range(len(block)):
+                        visit(b, i)
+                    if (not block or block[-1][0] not in tac.jump_ops) and b + 1 < cfg.nblocks:
+                        flow.append((b, b + 1))
+            else:
+                for b, i in uses.get(names.pop(), ()):
+                    if executable[b]:
+                        if i < 0:
+                            visit_phi(b, -1 - i)
+                        else:
+                            visit(b, i)
+
+        self.values = values
+        self.executable = executable
+
+    # Replace names with constant values by the constants, computations with
+    # constant results by copies of them and jumps on constant conditions by
+    # gotos or nothing.  The code of blocks that can't run is removed.
+    def apply_constants(self):
+        values = self.values
+
+        def constant(x):
+            value = values.get(x)
+            return value if isinstance(value, tac.Const) else x
+
+        for b, block in enumerate(self.blocks):
+            if not self.executable[b]:
+                block[:] = []
+                self.phis[b] = []
+                continue
+            for i, ins in enumerate(block):
+                op, dest, a, c = ins
+                if op in tac.binary_ops or op in (':=', 'neg'):
+                    if isinstance(values.get(dest), tac.Const):
+                        block[i] = (':=', dest, values[dest], None)
+                        continue
+                ins = tac.map_operands(ins, constant)
+                if op in ('iffalse', 'iftrue') and isinstance(ins[2], tac.Const):
+                    jump = (op == 'iftrue') == bool(ins[2].value)
+                    ins = ('goto', None, ins[3], None) if jump else None
+                block[i] = ins
+            block[:] = [ins for ins in block if ins is not None]
+
+    # Remove the computations whose results are never used.  Printing, jumps,
+    # declarations and the versions live at the end of the code are what is
+    # used.
+    def eliminate_dead_code(self):
+        defs = {}
+        for b, block in enumerate(self.blocks):
+            for dest, args in self.phis[b]:
+                defs[dest] = args
+            for ins in block:
+                if ins[0] in tac.binary_ops or ins[0] in (':=', 'neg'):
+                    defs[ins[1]] = tac.operands(ins)
+
+        live = set()
+        work = [x for b, names in self.exits.items() if self.executable[b] for x in names]
+        for block in self.blocks:
+            for ins in block:
+                if ins[0] in ('print', 'iffalse', 'iftrue'):
+                    work.extend(tac.operands(ins))
+        while work:
+            x = work.pop()
+            if _is_name(x) and x not in live:
+                live.add(x)
+                work.extend(defs.get(x, ()))
+
+        for b, block in enumerate(self.blocks):
+            self.phis[b] = [phi for phi in self.phis[b] if phi[0] in live]
+            block[:] = [ins for ins in block if ins[1] not in defs or ins[1] in live]
+
+    # Convert back out of SSA form and return the graph
+    def to_cfg(self):
+        def base(x):
+            return x.name if isinstance(x, Version) else x
+
+        blocks = []
+        for block in self.blocks:
+            code = []
+            for ins in block:
+                ins = tac.map_operands(ins, base)
+                code.append((ins[0], base(ins[1]), ins[2], ins[3]))
+            blocks.append(code)
+        cfg = self.cfg
+        cfg.set_blocks(blocks, cfg.labels)
+        cfg.remove_unreachable()
+        cfg.remove_redundant_jumps()
+        return cfg
+
+# Optimize a list of instructions with the passes in SSA form, then the loop
+# optimizations in loops.py and the passes in tac.py
+def optimize(code):
+    form = SSA(ir.ControlFlowGraph(code))
+    form.propagate_constants()
+    form.apply_constants()
+    form.eliminate_dead_code()
+    return tac.optimize(loops.optimize(form.to_cfg()).linearize())
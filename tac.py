@@ -0,0 +1,352 @@
+# -----------------------------------------------------------------------------
+# tac.py
+#
+# Three-address code for the programs parsed by compiler.py.
+#
+# An instruction is a tuple (op, dest, a, b):
+#
+#     ('dec', name, type, None)     -  Declaration of a variable
+#     (':=', dest, a, None)         -  Copy
+#     ('neg', dest, a, None)        -  Negation
+#     (op, dest, a, b)              -  Binary operation (op is one of binary_ops)
+#     ('print', None, a, None)      -  Print a value
+#     ('label', None, label, None)  -  Jump target
+#     ('goto', None, label, None)   -  Jump
+#     ('iffalse', None, a, label)   -  Jump if a is false
+#     ('iftrue', None, a, label)    -  Jump if a is true
+#
+# Operands are variable names (strings), temporaries (Temp) and constants
+# (Const).  Labels are Label numbers.
+# -----------------------------------------------------------------------------
+
+import heapq
+import operator
+from collections import namedtuple
+
+binary_ops = {'+', '-', '*', '/', '^', '==', '!=', '>=', '<=', '>', '<', 'and', 'or'}
+
+# What the operators do to Python values
+operations = {
+    '+':   operator.add,
+    '-':   operator.sub,
+    '*':   operator.mul,
+    '/':   operator.truediv,
+    '^':   operator.pow,
+    '==':  operator.eq,
+    '!=':  operator.ne,
+    '>=':  operator.ge,
+    '<=':  operator.le,
+    '>':   operator.gt,
+    '<':   operator.lt,
+    'and': lambda a, b: a and b,
+    'or':  lambda a, b: a or b,
+    }
+
+# Operators whose operands can be swapped for any operand types.  '+' is left
+# out because it concatenates strings.
+commutative_ops = {'*', '==', '!='}
+
+# Instructions that end a basic block
+jump_ops = {'goto', 'iffalse', 'iftrue'}
+
+class Temp(int):
+    def __repr__(self):
+        return 't%d' % self
+
+class Label(int):
+    def __repr__(self):
+        return 'L%d' % self
+
+Const = namedtuple('Const', ['value'])
+
+# Return the operands read by an instruction
+def operands(ins):
+    op, dest, a, b = ins
+    if op in binary_ops:
+        return (a, b)
+    if op in (':=', 'neg', 'print', 'iffalse', 'iftrue'):
+        return (a,)
+    return ()
+
+# Return an instruction with its operands replaced by func(operand)
+def map_operands(ins, func):
+    op, dest, a, b = ins
+    if op in binary_ops:
+        return (op, dest, func(a), func(b))
+    if op in (':=', 'neg', 'print', 'iffalse', 'iftrue'):
+        return (op, dest, func(a), b)
+    return ins
+
+# Value of variables that are declared without one
+defaults = {'int': 0, 'float': 0.0, 'string': '', 'boolean': False}
+
+# Return the text that print shows for a value
+def format_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+# Print a value
+def show(value):
+    print(format_value(value))
+
+# Return the label a jump goes to
+def jump_target(ins):
+    return ins[2] if ins[0] == 'goto' else ins[3]
+
+# Compute the result of an operation ('neg' or one of binary_ops) on values
+def evaluate(op, a, b=None):
+    if op == 'neg':
+        return -a
+    return operations[op](a, b)
+
+# Split a list of instructions into basic blocks.  A block starts at a label
+# and ends after a jump.
+def basic_blocks(code):
+    blocks = [[]]
+    for ins in code:
+        if ins[0] == 'label' and blocks[-1]:
+            blocks.append([])
+        blocks[-1].append(ins)
+        if ins[0] in jump_ops:
+            blocks.append([])
+    return [block for block in blocks if block]
+
+# -----------------------------------------------------------------------------
+# CodeGenerator
+#
+# Translates statements from the parser into three-address code.  Labels are
+# numbered across everything generated by the same object.
+# -----------------------------------------------------------------------------
+class CodeGenerator(object):
+    def __init__(self, optimizer=None):
+        self.labels = 0
+        self.optimizer = optimizer
+
+    # Generate the code for a sequence of statements
+    def generate(self, statements):
+        self.code = []
+        self.temps = 0
+        for node in statements:
+            self.statement(node)
+        return self.code
+
+    # Generate the code for a sequence of statements and optimize it, with
+    # optimize() unless another optimizer was given
+    def compile(self, statements):
+        return (self.optimizer or optimize)(self.generate(statements))
+
+    def emit(self, op, dest=None, a=None, b=None):
+        self.code.append((op, dest, a, b))
+
+    def new_temp(self):
+        self.temps += 1
+        return Temp(self.temps)
+
+    def new_label(self):
+        self.labels += 1
+        return Label(self.labels)
+
+    def statement(self, node):
+        kind = node[0]
+        if kind == 'declare':
+            self.emit('dec', node[2], node[1])
+        elif kind == 'declare assign':
+            self.emit('dec', node[2], node[1])
+            self.emit(':=', node[2], self.expression(node[3]))
+        elif kind == 'assign':
+            self.emit(':=', node[1], self.expression(node[2]))
+        elif kind == 'print':
+            self.emit('print', None, self.expression(node[1]))
+        elif kind == 'condition':
+            self.condition(node)
+        elif kind == 'for':
+            self.loop(node[2], node[4], init=node[1], step=node[3])
+        elif kind == 'while':
+            self.loop(node[1], node[2])
+        else:
+            raise ValueError('Unknown statement %r' % (node,))
+
+    def statements(self, nodes):
+        for node in nodes or ():
+            self.statement(node)
+
+    # if / elif / else
+    def condition(self, node):
+        _, ifpart, elifs, elsepart = node
+        end = self.new_label()
+        for _, cond, body in (ifpart,) + tuple(elifs or ()):
+            skip = self.new_label()
+            self.emit('iffalse', None, self.expression(cond), skip)
+            self.statements(body)
+            self.emit('goto', None, end)
+            self.emit('label', None, skip)
+        if elsepart:
+            self.statements(elsepart[1])
+        self.emit('label', None, end)
+
+    # for and while loops.  The condition is tested at the top of the loop.
+    def loop(self, cond, body, init=None, step=None):
+        if init:
+            self.statement(init)
+        top = self.new_label()
+        end = self.new_label()
+        self.emit('label', None, top)
+        self.emit('iffalse', None, self.expression(cond), end)
+        self.statements(body)
+        if step:
+            self.statement(step)
+        self.emit('goto', None, top)
+        self.emit('label', None, end)
+
+    # Return the operand holding the value of an expression
+    def expression(self, node):
+        if isinstance(node, tuple):
+            kind = node[0]
+            if kind == 'string':
+                return Const(node[1])
+            if kind == 'neg':
+                dest = self.new_temp()
+                self.emit('neg', dest, self.expression(node[1]))
+                return dest
+            if kind == 'operation':
+                a = self.expression(node[1])
+                b = self.expression(node[3])
+                dest = self.new_temp()
+                self.emit(node[2], dest, a, b)
+                return dest
+            raise ValueError('Unknown expression %r' % (node,))
+        if isinstance(node, str):
+            return node
+        return Const(node)
+
+# -----------------------------------------------------------------------------
+# allocate_temps()
+#
+# Reuse temporaries whose values are dead.  Temporaries never live across the
+# end of a basic block, so within each block the live range of a temporary runs
+# from its definition to its last use.  The blocks are scanned in order, and a
+# temporary gets the lowest number that is free at its definition.  A number is
+# freed after the last use of its temporary, so the destination of an
+# instruction can reuse one of its operands.  Numbering starts again at t1 in
+# every block.
+# -----------------------------------------------------------------------------
+def allocate_temps(code):
+    result = []
+    for block in basic_blocks(code):
+        last = {}
+        for i, ins in enumerate(block):
+            for x in operands(ins):
+                if isinstance(x, Temp):
+                    last[x] = i
+
+        free = []
+        count = 0
+        names = {}
+        for i, ins in enumerate(block):
+            ins = map_operands(ins, lambda x: names.get(x, x) if isinstance(x, Temp) else x)
+            for x in set(operands(block[i])):
+                if isinstance(x, Temp) and last[x] == i:
+                    heapq.heappush(free, names[x])
+            dest = block[i][1]
+            if isinstance(dest, Temp):
+                if free:
+                    names[dest] = heapq.heappop(free)
+                else:
+                    count += 1
+                    names[dest] = Temp(count)
+                ins = (ins[0], names[dest], ins[2], ins[3])
+                if dest not in last:
+                    heapq.heappush(free, names[dest])
+            result.append(ins)
+    return result
+
+# -----------------------------------------------------------------------------
+# value_numbering()
+#
+# Local value numbering.  Within each basic block, every operand gets a value
+# number: variables a new one whenever they are declared or assigned, constants
+# one per distinct type and value.  An operation whose operator and operand
+# value numbers were already computed into a temporary in the same block is
+# removed, and its temporary replaced by the earlier one.  Since assigning to a
+# variable gives it a new value number, expressions using its old value are
+# never matched again.
+# -----------------------------------------------------------------------------
+def value_numbering(code):
+    result = []
+    for block in basic_blocks(code):
+        numbers = {}      # Value number of each variable, temporary and constant
+        values = {}       # Temporary holding each (op, number, number) computed
+        alias = {}        # Temporaries replaced by an earlier one
+
+        def number(x):
+            key = (type(x.value), x.value) if isinstance(x, Const) else x
+            if key not in numbers:
+                numbers[key] = len(numbers)
+            return numbers[key]
+
+        for ins in block:
+            ins = map_operands(ins, lambda x: alias.get(x, x))
+            op, dest, a, b = ins
+            if op in binary_ops or op == 'neg':
+                if op == 'neg':
+                    key = (op, number(a))
+                elif op in commutative_ops:
+                    key = (op,) + tuple(sorted((number(a), number(b))))
+                else:
+                    key = (op, number(a), number(b))
+                if key in values:
+                    alias[dest] = values[key]
+                    continue
+                if isinstance(dest, Temp):
+                    values[key] = dest
+                numbers[dest] = len(numbers)
+            elif op == ':=':
+                numbers[dest] = number(a)
+            elif op == 'dec':
+                numbers[dest] = len(numbers)
+            result.append(ins)
+    return result
+
+# Optimize a list of instructions
+def optimize(code):
+    return allocate_temps(value_numbering(code))
+
+# -----------------------------------------------------------------------------
+# Formatting
+# -----------------------------------------------------------------------------
+
+def format_operand(x):
+    if isinstance(x, Const):
+        if isinstance(x.value, bool):
+            return 'true' if x.value else 'false'
+        if isinstance(x.value, str):
+            return '"%s"' % x.value.replace('\\', '\\\\').replace('"', '\\"')
+        return repr(x.value)
+    return repr(x) if isinstance(x, (Temp, Label)) else x
+
+def format_instruction(ins):
+    op, dest, a, b = ins
+    if op == 'dec':
+        return '{}dec ({})'.format(a, dest)
+    if op == ':=':
+        return '{} := {}'.format(format_operand(dest), format_operand(a))
+    if op == 'neg':
+        return '{} := - {}'.format(format_operand(dest), format_operand(a))
+    if op in binary_ops:
+        return '{} := {} {} {}'.format(format_operand(dest), format_operand(a), op, format_operand(b))
+    if op == 'print':
+        return 'print ({})'.format(format_operand(a))
+    if op == 'label':
+        return '{}:'.format(format_operand(a))
+    if op == 'goto':
+        return 'goto {}'.format(format_operand(a))
+    if op == 'iffalse':
+        return 'ifFalse {} goto {}'.format(format_operand(a), format_operand(b))
+    if op == 'iftrue':
+        return 'ifTrue {} goto {}'.format(format_operand(a), format_operand(b))
+    raise ValueError('Unknown instruction %r' % (ins,))
+
+def format_code(code):
+    return '\n'.join(format_instruction(ins) if ins[0] == 'label' else '    ' + format_instruction(ins)
+                     for ins in code)
@@ -0,0 +1,197 @@
+# -----------------------------------------------------------------------------
+# vectorize.py
+#
+# Runs counted for loops whose iterations don't depend on each other with
+# NumPy, all iterations at once:
+#
+#     for(int i = start; i < stop; i = i + 1){ x = i * k; s = s + x / 2; }
+#
+# The loop counts a variable up by one to a bound that doesn't change in the
+# loop, and its body is assignments only.  Every variable the body reads is
+# either not assigned in the loop, or assigned earlier in the same iteration,
+# or is a sum
+#
+#     s = s + <expression>    or    s = s - <expression>
+#
+# that nothing else in the body reads.  The iterations are then the lanes of
+# batch.Lanes, with the loop variable holding start, start + 1, ...  Sums are
+# added up in order, so floats round the same way as in a loop.
+#
+# run() returns None if the loop must be run as a loop after all: NumPy is
+# missing, the loop is short, the bounds aren't ints, a variable isn't a
+# number, or an iteration fails or would give a different result than in
+# Python.  Nothing has been changed then.
+# -----------------------------------------------------------------------------
+
+import tac
+import batch
+
+# Loops running fewer iterations than this are faster as loops
+min_iterations = 256
+
+# Number of iterations done at once
+chunk_size = 1 << 18
+
+# Return the names of the variables read by an expression
+def reads(node):
+    if isinstance(node, tuple):
+        if node[0] == 'operation':
+            return reads(node[1]) | reads(node[3])
+        if node[0] == 'neg':
+            return reads(node[1])
+        return set()
+    if isinstance(node, str):
+        return {node}
+    return set()
+
+# Return the name, operator and other operand of a sum s = s + e, s = e + s
+# or s = s - e, or None
+def sum_of(name, node):
+    if not (isinstance(node, tuple) and node[0] == 'operation' and node[2] in ('+', '-')):
+        return None
+    _, left, op, right = node
+    if op == '+' and right == name:
+        left, right = right, left
+    if left != name or name in reads(right):
+        return None
+    return op, right
+
+# -----------------------------------------------------------------------------
+# CountedLoop
+#
+# A for loop that can be run with NumPy.  names are the variables the loop
+# reads or assigns.
+# -----------------------------------------------------------------------------
+class CountedLoop(object):
+    def __init__(self, var, op, stop, body, sums, invariants):
+        self.var = var
+        self.op = op
+        self.stop = stop
+        self.body = body
+        self.sums = sums
+        self.invariants = invariants
+        self.names = {var} | invariants | {name for name, _ in body}
+
+    # Run the loop from the values of its variables after its initialization.
+    # Returns the new values of the variables, or None.
+    def run(self, values):
+        try:
+            np = batch._numpy()
+        except ImportError:
+            return None
+        start = values[self.var]
+        stop = values[self.stop] if isinstance(self.stop, str) else self.stop
+        if type(start) is not int or type(stop) is not int:
+            return None
+        if self.op == '<=':
+            stop += 1
+        if stop - start < min_iterations:
+            return None
+        for name in self.invariants | set(self.sums):
+            if type(values[name]) not in (int, float, bool) or name in self.sums and type(values[name]) is bool:
+                return None
+
+        result = {name: values[name] for name in self.sums}
+        for low in range(start, stop, chunk_size):
+            high = min(low + chunk_size, stop)
+            lanes = batch.Lanes(high - low)
+            every = np.ones(lanes.size, bool)
+            with np.errstate(all='ignore'):
+                lanes.env[self.var] = np.arange(low, high, dtype=np.int64)
+                for name in self.invariants:
+                    lanes.env[name] = lanes.constant(values[name])
+                for name, node in self.body:
+                    if name in self.sums:
+                        op, node = self.sums[name]
+                        result[name] = self.add(np, result[name], op, lanes.value(node, every))
+                        if result[name] is None:
+                            return None
+                    else:
+                        lanes.env[name] = lanes.value(node, every)
+                if not lanes.alive.all():
+                    return None
+            for name, node in self.body:
+                if name not in self.sums:
+                    result[name] = lanes.env[name][-1:].tolist()[0]
+        result[self.var] = stop
+        return result
+
+    # Add up the terms of a sum in order.  Returns None if they aren't numbers
+    # or an int sum may overflow 64 bits.
+    def add(self, np, total, op, terms):
+        if terms.dtype == object:
+            return None
+        if terms.dtype == bool:
+            terms = terms.astype(np.int64)
+        if type(total) is int and terms.dtype == np.int64:
+            if np.abs(terms.astype(np.float64)).sum() > batch.max_int:
+                return None
+            change = int(terms.sum())
+            return total + change if op == '+' else total - change
+        try:
+            first = float(total)
+        except OverflowError:
+            return None
+        ufunc = np.add if op == '+' else np.subtract
+        return ufunc.accumulate(np.concatenate(([first], terms.astype(np.float64))))[-1].item()
+
+# Return a CountedLoop for a ('for', init, cond, step, body) node, or None if
+# the loop isn't one that can be run with NumPy
+def counted_loop(node):
+    _, init, cond, step, body = node
+    if init[0] == 'declare assign' and init[1] == 'int':
+        var = init[2]
+    elif init[0] == 'assign':
+        var = init[1]
+    else:
+        return None
+    if not (isinstance(cond, tuple) and cond[0] == 'operation' and cond[1] == var and cond[2] in ('<', '<=')):
+        return None
+    stop = cond[3]
+    if not (isinstance(stop, str) and stop != var or type(stop) is int):
+        return None
+    by = step[2]
+    if step[0] != 'assign' or step[1] != var or not (isinstance(by, tuple) and by[0] == 'operation' and by[2] == '+'):
+        return None
+    if not (by[1] == var and type(by[3]) is int and by[3] == 1 or
+            by[3] == var and type(by[1]) is int and by[1] == 1):
+        return None
+
+    assignments = []
+    for statement in body or ():
+        kind = statement[0]
+        if kind == 'assign':
+            assignments.append((statement[1], statement[2]))
+        elif kind == 'declare assign':
+            assignments.append((statement[2], statement[3]))
+        elif kind == 'declare':
+            assignments.append((statement[2], batch.literal(tac.defaults[statement[1]])))
+        else:
+            return None
+    assigned = {name for name, _ in assignments}
+    if not assignments or var in assigned or stop in assigned:
+        return None
+
+    counts = {}
+    for name, _ in assignments:
+        counts[name] = counts.get(name, 0) + 1
+    sums = {}
+    for name, value in assignments:
+        total = sum_of(name, value)
+        if total and counts[name] == 1 and not any(name in reads(other) for other_name, other in assignments
+                                                   if other_name != name):
+            sums[name] = total
+
+    invariants = set()
+    done = set()
+    for name, value in assignments:
+        used = reads(sums[name][1]) if name in sums else reads(value)
+        for x in used - {var}:
+            if x not in assigned:
+                invariants.add(x)
+            elif x not in done or x in sums:
+                return None
+        done.add(name)
+    if isinstance(stop, str):
+        invariants.add(stop)
+    return CountedLoop(var, cond[2], stop, assignments, sums, invariants)
@@ -0,0 +1,556 @@
+# -----------------------------------------------------------------------------
+# vm.py
+#
+# A bytecode interpreter for the programs parsed by compiler.py.
+#
+# Statements are compiled to instructions for a stack machine.  Instructions
+# are tuples (opcode, args...) and variables are numbered slots in a list.
+# Loops test their condition at the bottom, so an iteration runs a single
+# conditional jump.
+#
+# Two things cut down the number of instructions dispatched:
+#
+#   - Quickening.  Operations are compiled to a generic BINARY instruction
+#     holding the operator.  The first time one runs, it rewrites itself
+#     into an instruction that computes the operation inline instead of
+#     looking up a function and calling it.  If both operands are ints,
+#     and the operation is one that loops count and compare with, this is
+#     an instruction for ints, which checks that its operands are still
+#     ints.  When they aren't, it deoptimizes: it rewrites itself into the
+#     instruction for its operator, which works for any types.
+#
+#   - Superinstructions.  Short sequences that are common in loops, such as
+#     LOAD_VAR, LOAD_CONST, BINARY <, JUMP_IF_FALSE, are fused into single
+#     instructions.  Which sequences to fuse is chosen from a profile of how
+#     often each pair of instructions runs one after the other.
+# -----------------------------------------------------------------------------
+
+import collections
+import tac
+
+opnames = [
+    # Generic instructions
+    'LOAD_CONST', 'LOAD_VAR', 'STORE_VAR', 'BINARY', 'NEG', 'PRINT',
+    'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_TRUE', 'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP',
+    # Quickened operations
+    'ADD', 'SUB', 'MUL', 'DIV', 'POW', 'EQ', 'NE', 'GE', 'LE', 'GT', 'LT',
+    'ADD_INT', 'SUB_INT', 'MUL_INT', 'EQ_INT', 'NE_INT', 'GE_INT', 'LE_INT', 'GT_INT', 'LT_INT',
+    # Superinstructions
+    'COMPARE_VAR_CONST_JUMP_IF_FALSE', 'COMPARE_VAR_CONST_JUMP_IF_TRUE',
+    'COMPARE_VAR_VAR_JUMP_IF_FALSE', 'COMPARE_VAR_VAR_JUMP_IF_TRUE',
+    'OP_VAR_CONST_STORE', 'OP_VAR_VAR_STORE', 'OP_VAR_CONST', 'OP_VAR_VAR', 'OP_STORE',
+    'STORE_CONST', 'COPY_VAR', 'PRINT_VAR',
+    ]
+
+(LOAD_CONST, LOAD_VAR, STORE_VAR, BINARY, NEG, PRINT,
+ JUMP, JUMP_IF_FALSE, JUMP_IF_TRUE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP,
+ ADD, SUB, MUL, DIV, POW, EQ, NE, GE, LE, GT, LT,
+ ADD_INT, SUB_INT, MUL_INT, EQ_INT, NE_INT, GE_INT, LE_INT, GT_INT, LT_INT,
+ COMPARE_VAR_CONST_JUMP_IF_FALSE, COMPARE_VAR_CONST_JUMP_IF_TRUE,
+ COMPARE_VAR_VAR_JUMP_IF_FALSE, COMPARE_VAR_VAR_JUMP_IF_TRUE,
+ OP_VAR_CONST_STORE, OP_VAR_VAR_STORE, OP_VAR_CONST, OP_VAR_VAR, OP_STORE,
+ STORE_CONST, COPY_VAR, PRINT_VAR) = range(len(opnames))
+
+# The instruction each operator is quickened into
+quickened = {
+    '+': ADD, '-': SUB, '*': MUL, '/': DIV, '^': POW,
+    '==': EQ, '!=': NE, '>=': GE, '<=': LE, '>': GT, '<': LT,
+    }
+
+# The instruction an operator on two ints is quickened into.  It holds the
+# operator, to deoptimize to quickened[operator].
+int_quickened = {
+    '+': ADD_INT, '-': SUB_INT, '*': MUL_INT,
+    '==': EQ_INT, '!=': NE_INT, '>=': GE_INT, '<=': LE_INT, '>': GT_INT, '<': LT_INT,
+    }
+
+compare_ops = {'==', '!=', '>=', '<=', '>', '<'}
+
+# Position of the jump target in the instructions that have one
+target_index = {
+    JUMP: 1, JUMP_IF_FALSE: 1, JUMP_IF_TRUE: 1, JUMP_IF_FALSE_OR_POP: 1, JUMP_IF_TRUE_OR_POP: 1,
+    COMPARE_VAR_CONST_JUMP_IF_FALSE: 4, COMPARE_VAR_CONST_JUMP_IF_TRUE: 4,
+    COMPARE_VAR_VAR_JUMP_IF_FALSE: 4, COMPARE_VAR_VAR_JUMP_IF_TRUE: 4,
+    }
+
+# The sequences that superinstructions replace.  The kind of an instruction
+# is its name, except that BINARY instructions are COMPARE or ARITH.  The
+# arguments of a superinstruction are the arguments of the instructions it
+# replaces, with the operators of BINARY instructions turned into functions.
+superinstructions = {
+    COMPARE_VAR_CONST_JUMP_IF_FALSE: ('LOAD_VAR', 'LOAD_CONST', 'COMPARE', 'JUMP_IF_FALSE'),
+    COMPARE_VAR_CONST_JUMP_IF_TRUE:  ('LOAD_VAR', 'LOAD_CONST', 'COMPARE', 'JUMP_IF_TRUE'),
+    COMPARE_VAR_VAR_JUMP_IF_FALSE:   ('LOAD_VAR', 'LOAD_VAR', 'COMPARE', 'JUMP_IF_FALSE'),
+    COMPARE_VAR_VAR_JUMP_IF_TRUE:    ('LOAD_VAR', 'LOAD_VAR', 'COMPARE', 'JUMP_IF_TRUE'),
+    OP_VAR_CONST_STORE:              ('LOAD_VAR', 'LOAD_CONST', 'ARITH', 'STORE_VAR'),
+    OP_VAR_VAR_STORE:                ('LOAD_VAR', 'LOAD_VAR', 'ARITH', 'STORE_VAR'),
+    OP_VAR_CONST:                    ('LOAD_VAR', 'LOAD_CONST', 'ARITH'),
+    OP_VAR_VAR:                      ('LOAD_VAR', 'LOAD_VAR', 'ARITH'),
+    OP_STORE:                        ('ARITH', 'STORE_VAR'),
+    STORE_CONST:                     ('LOAD_CONST', 'STORE_VAR'),
+    COPY_VAR:                        ('LOAD_VAR', 'STORE_VAR'),
+    PRINT_VAR:                       ('LOAD_VAR', 'PRINT'),
+    }
+
+# Number of superinstructions chosen from a profile
+max_superinstructions = 8
+
+# Superinstructions used when no profile is given.  These are the ones chosen
+# from the profile of data.txt and of loops counting and summing integers.
+default_superinstructions = (
+    OP_VAR_CONST_STORE, OP_VAR_CONST, COMPARE_VAR_CONST_JUMP_IF_TRUE, OP_STORE,
+    COMPARE_VAR_CONST_JUMP_IF_FALSE, OP_VAR_VAR_STORE, COMPARE_VAR_VAR_JUMP_IF_FALSE,
+    COMPARE_VAR_VAR_JUMP_IF_TRUE,
+    )
+
+# Return the quickened instruction for an operator, given its first operands
+def quicken(operator, a, b):
+    if type(a) is int and type(b) is int and operator in int_quickened:
+        return (int_quickened[operator], operator)
+    return (quickened[operator],)
+
+# Return the kind of an instruction, as used in superinstructions
+def kind(ins):
+    if ins[0] == BINARY:
+        return 'COMPARE' if ins[1] in compare_ops else 'ARITH'
+    return opnames[ins[0]]
+
+# -----------------------------------------------------------------------------
+# BytecodeCompiler
+# -----------------------------------------------------------------------------
+class BytecodeCompiler(object):
+    def __init__(self):
+        self.code = []
+        self.slots = {}
+
+    def compile(self, statements):
+        self.statements(statements)
+        return Program(self.code, self.slots)
+
+    def emit(self, *ins):
+        self.code.append(ins)
+        return len(self.code) - 1
+
+    # Set the target of the jump at position at to the next instruction
+    def patch(self, at):
+        ins = self.code[at]
+        self.code[at] = ins[:1] + (len(self.code),) + ins[2:]
+
+    def slot(self, name):
+        if name not in self.slots:
+            self.slots[name] = len(self.slots)
+        return self.slots[name]
+
+    def statements(self, nodes):
+        for node in nodes or ():
+            self.statement(node)
+
+    def statement(self, node):
+        kind = node[0]
+        if kind == 'declare':
+            self.emit(LOAD_CONST, tac.defaults[node[1]])
+            self.emit(STORE_VAR, self.slot(node[2]))
+        elif kind == 'declare assign':
+            self.expression(node[3])
+            self.emit(STORE_VAR, self.slot(node[2]))
+        elif kind == 'assign':
+            self.expression(node[2])
+            self.emit(STORE_VAR, self.slot(node[1]))
+        elif kind == 'print':
+            self.expression(node[1])
+            self.emit(PRINT)
+        elif kind == 'condition':
+            self.condition(node)
+        elif kind == 'for':
+            self.statement(node[1])
+            self.loop(node[2], tuple(node[4] or ()) + (node[3],))
+        elif kind == 'while':
+            self.loop(node[1], node[2])
+        else:
+            raise ValueError('Unknown statement %r' % (node,))
+
+    # if / elif / else
+    def condition(self, node):
+        _, ifpart, elifs, elsepart = node
+        branches = (ifpart,) + tuple(elifs or ())
+        ends = []
+        for i, (_, cond, body) in enumerate(branches):
+            self.expression(cond)
+            skip = self.emit(JUMP_IF_FALSE, None)
+            self.statements(body)
+            if elsepart or i < len(branches) - 1:
+                ends.append(self.emit(JUMP, None))
+            self.patch(skip)
+        if elsepart:
+            self.statements(elsepart[1])
+        for at in ends:
+            self.patch(at)
+
+    #         JUMP test
+    #   body: <body>
+    #   test: <cond>
+    #         JUMP_IF_TRUE body
+    def loop(self, cond, body):
+        jump = self.emit(JUMP, None)
+        top = len(self.code)
+        self.statements(body)
+        self.patch(jump)
+        self.expression(cond)
+        self.emit(JUMP_IF_TRUE, top)
+
+    def expression(self, node):
+        if isinstance(node, tuple):
+            kind = node[0]
+            if kind == 'string':
+                self.emit(LOAD_CONST, node[1])
+            elif kind == 'neg':
+                self.expression(node[1])
+                self.emit(NEG)
+            elif kind == 'operation':
+                _, left, op, right = node
+                self.expression(left)
+                if op in ('and', 'or'):
+                    jump = self.emit(JUMP_IF_FALSE_OR_POP if op == 'and' else JUMP_IF_TRUE_OR_POP, None)
+                    self.expression(right)
+                    self.patch(jump)
+                else:
+                    self.expression(right)
+                    self.emit(BINARY, op)
+            else:
+                raise ValueError('Unknown expression %r' % (node,))
+        elif isinstance(node, str):
+            self.emit(LOAD_VAR, self.slot(node))
+        else:
+            self.emit(LOAD_CONST, node)
+
+# Replace the sequences of instructions of the chosen superinstructions.  A
+# sequence isn't fused if a jump goes into the middle of it.
+def fuse(code, chosen):
+    patterns = sorted(((superinstructions[op], op) for op in chosen), key=lambda p: -len(p[0]))
+    targets = {ins[target_index[ins[0]]] for ins in code if ins[0] in target_index}
+    kinds = [kind(ins) for ins in code]
+    result = []
+    where = []
+    i = 0
+    while i < len(code):
+        where.append(len(result))
+        for pattern, op in patterns:
+            n = len(pattern)
+            if tuple(kinds[i:i+n]) == pattern and not targets.intersection(range(i + 1, i + n)):
+                args = []
+                for ins in code[i:i+n]:
+                    if ins[0] == BINARY:
+                        args.append(tac.operations[ins[1]])
+                    else:
+                        args.extend(ins[1:])
+                result.append((op,) + tuple(args))
+                where.extend([len(result) - 1] * (n - 1))
+                i += n
+                break
+        else:
+            result.append(code[i])
+            i += 1
+    where.append(len(result))
+
+    for i, ins in enumerate(result):
+        if ins[0] in target_index:
+            at = target_index[ins[0]]
+            result[i] = ins[:at] + (where[ins[at]],) + ins[at+1:]
+    return result
+
+# -----------------------------------------------------------------------------
+# Program
+#
+# Compiled code and the slots of its variables.  run() runs it and returns
+# the final values of the variables.  Quickening changes code as it runs, so
+# later runs start with the quickened instructions.
+# -----------------------------------------------------------------------------
+class Program(object):
+    def __init__(self, code, slots):
+        self.code = code
+        self.slots = slots
+
+    # Return a copy of the program with superinstructions
+    def fuse(self, chosen=default_superinstructions):
+        return Program(fuse(self.code, chosen), self.slots)
+
+    def run(self, show=tac.show):
+        env = [None] * len(self.slots)
+        execute(self.code, env, show)
+        return {name: env[i] for name, i in self.slots.items()}
+
+    def disassemble(self):
+        names = {i: name for name, i in self.slots.items()}
+        lines = []
+        for pc, ins in enumerate(self.code):
+            args = []
+            for x in ins[1:]:
+                args.append(getattr(x, '__name__', None) or repr(x))
+            line = '%4d %s %s' % (pc, opnames[ins[0]], ' '.join(args))
+            if ins[0] in (LOAD_VAR, STORE_VAR, PRINT_VAR):
+                line += ' (%s)' % names[ins[1]]
+            lines.append(line.rstrip())
+        return '\n'.join(lines)
+
+# Rewrite the int instruction at pc, whose operands a and b aren't both ints,
+# into the instruction for its operator, and return the result of the
+# operation
+def deoptimize(code, pc, a, b):
+    operator = code[pc][1]
+    code[pc] = (quickened[operator],)
+    return tac.operations[operator](a, b)
+
+# Run code.  The branches are in roughly the order of how often the
+# instructions run in loops.
+def execute(code, env, show):
+    stack = []
+    push = stack.append
+    pop = stack.pop
+    operations = tac.operations
+    end = len(code)
+    pc = 0
+    while pc < end:
+        ins = code[pc]
+        op = ins[0]
+        pc += 1
+        if op == COMPARE_VAR_CONST_JUMP_IF_TRUE:
+            if ins[3](env[ins[1]], ins[2]):
+                pc = ins[4]
+        elif op == OP_VAR_CONST_STORE:
+            env[ins[4]] = ins[3](env[ins[1]], ins[2])
+        elif op == LOAD_VAR:
+            push(env[ins[1]])
+        elif op == LOAD_CONST:
+            push(ins[1])
+        elif op == STORE_VAR:
+            env[ins[1]] = pop()
+        elif op == COMPARE_VAR_VAR_JUMP_IF_TRUE:
+            if ins[3](env[ins[1]], env[ins[2]]):
+                pc = ins[4]
+        elif op == COMPARE_VAR_CONST_JUMP_IF_FALSE:
+            if not ins[3](env[ins[1]], ins[2]):
+                pc = ins[4]
+        elif op == COMPARE_VAR_VAR_JUMP_IF_FALSE:
+            if not ins[3](env[ins[1]], env[ins[2]]):
+                pc = ins[4]
+        elif op == OP_VAR_VAR_STORE:
+            env[ins[4]] = ins[3](env[ins[1]], env[ins[2]])
+        elif op == OP_VAR_CONST:
+            push(ins[3](env[ins[1]], ins[2]))
+        elif op == OP_VAR_VAR:
+            push(ins[3](env[ins[1]], env[ins[2]]))
+        elif op == OP_STORE:
+            b = pop()
+            env[ins[2]] = ins[1](pop(), b)
+        elif op == JUMP_IF_TRUE:
+            if pop():
+                pc = ins[1]
+        elif op == JUMP_IF_FALSE:
+            if not pop():
+                pc = ins[1]
+        elif op == JUMP:
+            pc = ins[1]
+        elif op == ADD_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a + b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == SUB_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a - b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == MUL_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a * b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == LT_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a < b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == LE_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a <= b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == GT_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a > b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == GE_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a >= b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == EQ_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a == b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == NE_INT:
+            b = pop()
+            a = stack[-1]
+            if type(a) is int and type(b) is int:
+                stack[-1] = a != b
+            else:
+                stack[-1] = deoptimize(code, pc - 1, a, b)
+        elif op == ADD:
+            b = pop()
+            stack[-1] = stack[-1] + b
+        elif op == SUB:
+            b = pop()
+            stack[-1] = stack[-1] - b
+        elif op == MUL:
+            b = pop()
+            stack[-1] = stack[-1] * b
+        elif op == LT:
+            b = pop()
+            stack[-1] = stack[-1] < b
+        elif op == LE:
+            b = pop()
+            stack[-1] = stack[-1] <= b
+        elif op == GT:
+            b = pop()
+            stack[-1] = stack[-1] > b
+        elif op == GE:
+            b = pop()
+            stack[-1] = stack[-1] >= b
+        elif op == EQ:
+            b = pop()
+            stack[-1] = stack[-1] == b
+        elif op == NE:
+            b = pop()
+            stack[-1] = stack[-1] != b
+        elif op == DIV:
+            b = pop()
+            stack[-1] = stack[-1] / b
+        elif op == POW:
+            b = pop()
+            stack[-1] = stack[-1] ** b
+        elif op == PRINT_VAR:
+            show(env[ins[1]])
+        elif op == STORE_CONST:
+            env[ins[2]] = ins[1]
+        elif op == COPY_VAR:
+            env[ins[2]] = env[ins[1]]
+        elif op == PRINT:
+            show(pop())
+        elif op == NEG:
+            stack[-1] = -stack[-1]
+        elif op == JUMP_IF_FALSE_OR_POP:
+            if stack[-1]:
+                pop()
+            else:
+                pc = ins[1]
+        elif op == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = ins[1]
+            else:
+                pop()
+        elif op == BINARY:
+            # Quicken, then do the operation
+            b = pop()
+            code[pc-1] = quicken(ins[1], stack[-1], b)
+            stack[-1] = operations[ins[1]](stack[-1], b)
+        else:
+            raise RuntimeError('Bad opcode %d at %d' % (op, pc - 1))
+
+# -----------------------------------------------------------------------------
+# Profile
+#
+# Counts how many times each pair of kinds of instructions runs one right
+# after the other, without a jump in between, in runs of generic code.
+# -----------------------------------------------------------------------------
+class Profile(object):
+    def __init__(self):
+        self.pairs = collections.Counter()
+
+    # Run the generic code of a program and count its pairs
+    def run(self, program, show=tac.show):
+        code = program.code
+        kinds = [kind(ins) for ins in code]
+        pairs = collections.Counter()
+        env = [None] * len(program.slots)
+        stack = []
+        operations = tac.operations
+        pc = 0
+        last = -2
+        while pc < len(code):
+            if last == pc - 1:
+                pairs[kinds[last], kinds[pc]] += 1
+            last = pc
+            ins = code[pc]
+            op = ins[0]
+            pc += 1
+            if op == LOAD_CONST:
+                stack.append(ins[1])
+            elif op == LOAD_VAR:
+                stack.append(env[ins[1]])
+            elif op == STORE_VAR:
+                env[ins[1]] = stack.pop()
+            elif op == BINARY:
+                b = stack.pop()
+                stack[-1] = operations[ins[1]](stack[-1], b)
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+            elif op == PRINT:
+                show(stack.pop())
+            elif op == JUMP:
+                pc = ins[1]
+            elif op == JUMP_IF_FALSE:
+                if not stack.pop():
+                    pc = ins[1]
+            elif op == JUMP_IF_TRUE:
+                if stack.pop():
+                    pc = ins[1]
+            elif op == JUMP_IF_FALSE_OR_POP:
+                if stack[-1]:
+                    stack.pop()
+                else:
+                    pc = ins[1]
+            elif op == JUMP_IF_TRUE_OR_POP:
+                if stack[-1]:
+                    pc = ins[1]
+                else:
+                    stack.pop()
+            else:
+                raise RuntimeError('%s is not a generic instruction' % opnames[op])
+        self.pairs.update(pairs)
+        return self
+
+    # Return the superinstructions worth building.  A sequence runs at most as
+    # often as its rarest pair, and fusing it saves one dispatch for each
+    # instruction after the first.
+    def choose(self, limit=max_superinstructions):
+        scores = []
+        for op, pattern in superinstructions.items():
+            score = min(self.pairs[pair] for pair in zip(pattern, pattern[1:])) * (len(pattern) - 1)
+            if score:
+                scores.append((-score, op))
+        return tuple(op for score, op in sorted(scores)[:limit])
+
+    def format(self):
+        return '\n'.join('%10d  %s %s' % (count, a, b) for (a, b), count in self.pairs.most_common())
+
+# Compile the statements of a program to generic code
+def compile_statements(statements):
+    return BytecodeCompiler().compile(statements)